@@ -3,44 +3,25 @@ import os
 import time
 import re
 import functools
-import logging
 import json
-import uuid
-import subprocess
-import pickle
+import bisect
 import shlex
-from subprocess import STDOUT, check_output, TimeoutExpired
-from subprocess import Popen, PIPE
+import hashlib
 import threading
 import sublime
 import sublime_plugin
 from sublime import load_settings, set_timeout_async, Region, DRAW_EMPTY
 from sublime import INHIBIT_WORD_COMPLETIONS, INHIBIT_EXPLICIT_COMPLETIONS
-import pygments
-import pygments.lexers
-from pygments.lexers import SwiftLexer
-import xml
-import xml.etree
-from xml.etree import ElementTree as ET
-
-# dependency paths
-package_path = os.path.dirname(__file__)
-packages = ["ijson","cffi","pycparser"]
-paths = [os.path.join(package_path, package) for package in packages]
-
-# add paths
-for path in paths:
-    if path not in sys.path:
-        sys.path.append(path)
-
-# import dependencies
-try:
-    # fast yajl backend
-    import ijson.backends.yajl2_cffi as ijson
-except:
-    # pure python backend
-    logging.warning("Failed to import yajl2_cffi backend for ijson.")
-    import ijson
+
+# completion core, adds dependency paths
+from .kitten import core, server
+from .kitten.core import ijson, pickle, subprocess
+
+# import dependencies on first use
+ET = core.LazyImport("xml.etree.ElementTree")
+uuid = core.LazyImport("uuid")
+zlib = core.LazyImport("zlib")
+futures = core.LazyImport("concurrent.futures")
 
 
 
@@ -52,8 +33,11 @@ if sys.version_info < (3, 3):
 
 def plugin_loaded():
     """Called directly from sublime on plugin load"""
-    SwiftKittenEventListener._load_framework_cache()
-    pass
+    SwiftKittenEventListener.engine = core.CompletionEngine(
+        SwiftKittenEventListener._get_cache_path())
+
+    # keep plugin loading fast, the cache is only needed for completions
+    set_timeout_async(SwiftKittenEventListener.engine.load_framework_cache, 0)
 
 
 #def plugin_unloaded():
@@ -62,39 +46,50 @@ def plugin_loaded():
 
 
 
-class AutocompleteRequestError(RuntimeError):
-    def __init__(self,*args,**kwargs):
-        RuntimeError.__init__(self,*args,**kwargs)
-
-
-
 class SwiftKittenEventListener(sublime_plugin.EventListener):
     """
     """
 
-    # regexes for formatting function args in completion request
-    prog = re.compile(r"<#T##(.+?)#>")
-    arg_prog = re.compile(r"##.+")
+    # regex for import framework statements
+    import_prog = re.compile(r"import(\s+)(\w+)")
 
-    # cache of completion data
-    cache = {}
-    framework_cache = {}
+    # completion engine in the plugin host, see `get_engine`
+    engine = None
+
+    # client of the completion server and when it was last started
+    client = None
+    server_started = 0
 
     # id of current completion query
     query_id = None
 
-    # number of concurrent completion requests
-    current_requests = set()
+    # number of characters before the completion offset
+    # in which the stub is parsed, see `_completion_phases`
+    stub_context = 4096
+
+    # last completions of each buffer, and number of queries
+    # over `completion_budget`, see `on_query_completions`
+    answers = {}
+    budget_overruns = 0
+
+    # imported frameworks of each buffer, see `_get_imports`
+    imports = {}
+
+    # declarations of each buffer, from structure info
+    symbols = {}
+
+    # function bodies of each buffer, from structure info, and the first
+    # position modified since, see `_slice_text`
+    bodies = {}
+    modified = {}
 
     # linting
     errors = {}
 
-    # idle parameters
-    delay = 300
-    pending = 0
-
-    # pygments Swift language parser
-    lexer = SwiftLexer()
+    # idle timers, and measured structure latency and typing
+    # rate of each buffer, see `_get_idle_delay`
+    timers = None
+    idle_stats = {}
 
 
     def __init__(self):
@@ -104,20 +99,62 @@ class SwiftKittenEventListener(sublime_plugin.EventListener):
         SwiftKittenEventListener.shared_instance = self
 
 
-    def handle_timeout(self, view):
+    def _get_idle_delay(self, view):
+        """Get the delay after the last modification before linting, in ms.
+
+        The delay is longer while the user types fast, or when structure
+        requests for the buffer are slow, and stays within the
+        `idle_delay_min` and `idle_delay_max` settings. Until a structure
+        request has been measured, its latency is estimated from the
+        buffer size.
         """
+        stats = self.idle_stats.get(view.buffer_id(), {})
+        min_delay = self.get_settings(view, "idle_delay_min", 150)
+        max_delay = self.get_settings(view, "idle_delay_max", 2000)
+
+        latency = stats.get("latency")
+        if latency is None:
+            latency = view.size() / 1000.0
+
+        # keystrokes per second, 0 until measured
+        interval = stats.get("interval")
+        rate = 1000.0 / interval if interval else 0
+
+        delay = max(2 * latency, 100 * rate)
+        return int(min(max(delay, min_delay), max_delay))
+
+
+    def _update_idle_stats(self, view, key, value):
+        """Update a moving average of the idle stats of a buffer.
         """
-        self.pending -= 1
-        if self.pending == 0:
-            self.on_idle(view)
+        stats = self.idle_stats.setdefault(view.buffer_id(), {})
+        average = stats.get(key)
+        stats[key] = value if average is None else 0.7 * average + 0.3 * value
 
 
     def on_idle(self, view):
         """
         """
-        structure_info = self._get_structure_info(view)
+        buffer_id = view.buffer_id()
+        self.modified.pop(buffer_id, None)
+
+        text = view.substr(Region(0, view.size()))
+        start = time.time()
+        try:
+            depth = None if self.get_settings(view, "local_symbols", True) else 1
+            structure_info = self._get_structure_info(view, text, depth)
+        except core.SourceKittenError as e:
+            print("SwiftKitten:", e)
+            self._update_breaker_status(view)
+            return
+        self._update_idle_stats(view, "latency", (time.time() - start) * 1000)
+        self._update_breaker_status(view)
         linting = self.get_settings(view, "linting", True)
 
+        # local symbol table
+        self.symbols[buffer_id] = get_symbols(structure_info, text)
+        self.bodies[buffer_id] = get_bodies(structure_info, text)
+
         # linting
         if linting and "key.diagnostics" in structure_info:
             diagnostics = structure_info["key.diagnostics"]
@@ -153,12 +190,74 @@ class SwiftKittenEventListener(sublime_plugin.EventListener):
         self.errors = {}
         view.erase_regions("swiftkitten.diagnostics")
 
+        self._update_imports(view)
+
+        # function bodies after this position have moved
+        buffer_id = view.buffer_id()
+        pos = min(region.begin() for region in sel)
+        self.modified[buffer_id] = min(self.modified.get(buffer_id, pos), pos)
+
         self.query_id = None
-        self.pending += 1
 
-        def handle_timeout():
-            self.handle_timeout(view)
-        sublime.set_timeout_async(handle_timeout, self.delay)
+        # typing rate, ignoring pauses
+        now = time.time()
+        stats = self.idle_stats.setdefault(buffer_id, {})
+        interval = (now - stats.get("last_modified", 0)) * 1000
+        stats["last_modified"] = now
+        if interval < 1000:
+            self._update_idle_stats(view, "interval", interval)
+
+        # (re)start idle timer of this buffer
+        if self.timers is None:
+            SwiftKittenEventListener.timers = TimerWheel(sublime.set_timeout_async)
+
+        on_idle = functools.partial(self.on_idle, view)
+        self.timers.schedule(buffer_id, self._get_idle_delay(view), on_idle)
+
+
+    def on_close(self, view):
+        """
+        """
+        # only buffers with completion queries have engine state
+        tracked = view.buffer_id() in self.imports or \
+            view.buffer_id() in self.answers
+
+        self.imports.pop(view.buffer_id(), None)
+        self.symbols.pop(view.buffer_id(), None)
+        self.bodies.pop(view.buffer_id(), None)
+        self.modified.pop(view.buffer_id(), None)
+        self.idle_stats.pop(view.buffer_id(), None)
+        self.answers.pop(view.buffer_id(), None)
+
+        if self.timers is not None:
+            self.timers.cancel(view.buffer_id())
+
+        if not tracked:
+            return
+
+        # settings are not available for a closing view, so the
+        # engines which may have answered queries are used as they are
+        if self.engine is not None:
+            self.engine.close_buffer(view.buffer_id())
+
+        client = self.client
+        if client is not None and os.path.exists(client.path):
+            try:
+                client.close_buffer(view.buffer_id())
+            except (OSError, server.CompletionServerError) as e:
+                print("SwiftKitten: completion server failed:", e)
+
+
+    def on_activated_async(self, view):
+        """
+        """
+        sel = view.sel()
+        if len(sel) == 0 or not view.match_selector(sel[0].a, "source.swift"):
+            return
+
+        index = self._get_index(view)
+        if index is not None and not index.indexed:
+            self._update_index(view, index)
 
 
     def on_post_save_async(self, view):
@@ -168,7 +267,35 @@ class SwiftKittenEventListener(sublime_plugin.EventListener):
         if not view.match_selector(sel[0].a, "source.swift"):
             return
 
-        self._save_framework_cache()
+        try:
+            self.get_engine(view).save_framework_cache()
+        except (OSError, server.CompletionServerError) as e:
+            print("SwiftKitten: failed to save framework cache:", e)
+
+        index = self._get_index(view)
+        if index is not None and view.file_name() is not None:
+            self._update_index(view, index, [view.file_name()])
+
+
+    def _get_index(self, view):
+        """Get the project index for the window of view, if enabled.
+        """
+        window = view.window()
+        if window is None or not window.folders() or \
+                not self.get_settings(view, "indexing", True):
+            return None
+
+        return SwiftKittenIndex.get(window)
+
+
+    def _update_index(self, view, index, paths=None):
+        """
+        """
+        sourcekitten_binary = self.get_settings(view,
+            "sourcekitten_binary", "sourcekitten")
+        workers = self.get_settings(view, "index_workers", 4)
+        timeout = self.get_settings(view, "sourcekitten_timeout", 10.0)
+        index.update(sourcekitten_binary, workers, paths, timeout)
 
 
     def _update_linting_status(self, view):
@@ -183,6 +310,27 @@ class SwiftKittenEventListener(sublime_plugin.EventListener):
             view.erase_status("swiftkitten.diagnostics")
 
 
+    def _update_breaker_status(self, view):
+        """Show in the status bar which SourceKitten requests are paused
+        by a circuit breaker.
+        """
+        states = core.get_breaker_states()
+
+        engine = self.get_engine(view)
+        if engine is not self.engine:
+            try:
+                states.update(engine.get_breaker_states())
+            except (OSError, server.CompletionServerError):
+                pass
+
+        if states:
+            view.set_status("swiftkitten.breaker",
+                "SourceKitten {commands} paused".format(
+                    commands=", ".join(sorted(states))))
+        else:
+            view.erase_status("swiftkitten.breaker")
+
+
     def on_selection_modified(self, view):
         """
         """
@@ -219,32 +367,6 @@ class SwiftKittenEventListener(sublime_plugin.EventListener):
         return compilerargs
 
 
-    def _format_match(self, index, match):
-        """
-        """
-        index[0] += 1
-        arg = self.arg_prog.sub("", match.group(1))
-        return "${%s:%s}" % (index[0], arg)
-
-
-    def _format_snippet(self, text):
-        """
-        """
-        index = [0]
-        snippet = self.prog.sub(functools.partial(self._format_match, index), text)
-        return snippet
-
-
-    def _format_completion(self, entry):
-        """
-        """
-        description = entry["descriptionKey"]
-        hint = entry["docBrief"] if "docBrief" in entry else entry["typeName"]
-        snippet = self._format_snippet(entry["sourcetext"]).strip(".")
-        #snippet = json.dumps(entry)
-        return [description + '\t' + hint, snippet]
-
-
     @classmethod
     def _get_cache_path(cls):
         """
@@ -253,55 +375,85 @@ class SwiftKittenEventListener(sublime_plugin.EventListener):
 
 
     @classmethod
-    def _load_framework_cache(cls):
-        """
+    def get_settings(self, view, key, default=None):
+        """Get user settings for key.
+
+        Combine SwiftKitten package settings with project settings
         """
-        framework_cache_path = os.path.join(cls._get_cache_path(), "frameworks.cache")
+        settings = load_settings("SwiftKitten.sublime-settings")
+        project_data = view.window().project_data()
+        return project_data.get(key, settings.get(key, default))
 
-        if os.path.exists(framework_cache_path):
-            with open(framework_cache_path, "rb") as f:
-                cls.framework_cache = pickle.load(f)
 
+    def get_engine(self, view):
+        """Get the completion engine.
 
-    @classmethod
-    def _save_framework_cache(cls):
-        """
+        With `completion_server` enabled, this is a client of the server
+        process, which is started if it is not running. Until it accepts
+        connections, the engine in the plugin host is used.
         """
-        cache_path = cls._get_cache_path()
+        if not self.get_settings(view, "completion_server", False):
+            return self.engine
 
-        if not os.path.exists(cache_path):
-            os.mkdir(cache_path)
+        cls = SwiftKittenEventListener
+        socket_path = os.path.join(self._get_cache_path(), "server.sock")
 
-        framework_cache_path = os.path.join(cache_path, "frameworks.cache")
+        if cls.client is None or cls.client.path != socket_path:
+            cls.client = server.Client(socket_path, timeout=5.0)
 
-        with open(framework_cache_path, "wb") as f:
-            pickle.dump(cls.framework_cache, f)
+        if os.path.exists(socket_path):
+            return cls.client
 
+        # start server, at most every few seconds
+        if time.time() - cls.server_started > 10:
+            cls.server_started = time.time()
 
-    @classmethod
-    def get_settings(self, view, key, default=None):
-        """Get user settings for key.
+            if not os.path.exists(self._get_cache_path()):
+                os.makedirs(self._get_cache_path())
 
-        Combine SwiftKitten package settings with project settings
-        """
-        settings = load_settings("SwiftKitten.sublime-settings")
-        project_data = view.window().project_data()
-        return project_data.get(key, settings.get(key, default))
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+            python_binary = self.get_settings(view, "python_binary", "python3")
+
+            try:
+                server.start_server(socket_path, python_binary,
+                    self._get_cache_path(), env)
+            except OSError as e:
+                print("SwiftKitten: failed to start completion server:", e)
+
+        return self.engine
 
 
-    def get_completion_cmd(self, view, text, offset):
-        """Get completion command.
+    def get_engine_options(self, view):
+        """Get options of completion requests from user settings.
         """
-        cmd = "{sourcekitten_binary} complete --text {text} --offset {offset} -- {compilerargs}"
-        sourcekitten_binary = self.get_settings(view,
-            "sourcekitten_binary", "sourcekitten")
-        compilerargs = self.get_compilerargs(view)
-        return cmd.format(
-            sourcekitten_binary=sourcekitten_binary,
-            text=shlex.quote(text),
-            offset=offset,
-            compilerargs=shlex.quote(compilerargs)
-        )
+        return {
+            "sourcekitten_binary"      : self.get_settings(view,
+                "sourcekitten_binary", "sourcekitten"),
+            "compilerargs"             : self.get_compilerargs(view),
+            "cache_timeout"            : self.get_settings(view, "cache_timeout", 1.0),
+            "sourcekitten_timeout"     : self.get_settings(view,
+                "sourcekitten_timeout", 10.0),
+            "framework_timeout"        : self.get_settings(view,
+                "framework_timeout", 120.0),
+            "concurrent_request_limit" : self.get_settings(view,
+                "concurrent_request_limit", 4),
+            "persistent_cache_size"    : self.get_settings(view,
+                "persistent_cache_size", 16 * 1024 * 1024),
+            "project"                  : self._get_project(view),
+            "file_name"                : view.file_name(),
+            "imports"                  : [f[0] for f in
+                self._get_imports_entry(view)["frameworks"]]
+        }
+
+
+    def _get_project(self, view):
+        """Get the project file, or the folders, of the window of view.
+        """
+        window = view.window()
+        if window is None:
+            return ""
+
+        return window.project_file_name() or "\n".join(sorted(window.folders()))
 
 
     def get_structure_info_cmd(self, view, text):
@@ -316,185 +468,240 @@ class SwiftKittenEventListener(sublime_plugin.EventListener):
         )
 
 
-    def _get_structure_info(self, view):
+    def _get_structure_info(self, view, text, depth=None):
+        """Get diagnostics and declarations, down to depth levels of
+        nesting, from structure info.
         """
-        """
-         #get structure info command
-        text = view.substr(Region(0, view.size()))
+        # get structure info command
         cmd = self.get_structure_info_cmd(view, text)
-        timeout = self.get_settings(view, "sourcekitten_timeout", 1.0)
+        timeout = self.get_settings(view, "sourcekitten_timeout", 10.0)
 
         # run structure info command
-        p = Popen(cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        structure_info = list(ijson.items(p.stdout,''))[0]
+        return core.run_sourcekitten("structure", cmd,
+            lambda f: core.read_structure(ijson.parse(f), depth), timeout)
 
-        return structure_info
 
+    def _slice_text(self, view, text, offset):
+        """Reduce the text of a completion request for large buffers.
 
-    def _parse_completions(self, parser, included=lambda item: True):
-        """Parse and format completion data from a ijson parser.
+        Function bodies which do not enclose offset are removed, keeping
+        imports, type declarations, signatures and the enclosing scope.
+        Returns the reduced text and offset, or None if the buffer is
+        below `slicing_threshold` or there is nothing to remove.
         """
-        item = None
-        item_ids = set()
-        for prefix, event, value in parser:
-            if event == "start_map":
-                item = {}
-            elif event == "end_map":
-                # exclude duplicates
-                item_id = item.get("associatedUSRs", item["name"])
-                if included(item) and item_id not in item_ids:
-                    item_ids.add(item_id)
-                    # yield formatted completion
-                    yield self._format_completion(item)
-            elif event == "map_key":
-                item[value] = next(parser)[2]
+        threshold = self.get_settings(view, "slicing_threshold", 100000)
+        if not threshold or view.size() < threshold:
+            return None
 
+        buffer_id = view.buffer_id()
+        bodies = self.bodies.get(buffer_id, [])
 
-    def _autocomplete_request(self, view, cache, request,
-            text, offset, included=lambda item: True):
-        """
-        """
-        # this should not happen, but just in case, do not
-        # overload the system with too many requests
-        if len(self.current_requests) > self.get_settings(view, "concurrent_request_limit", 4):
-            raise AutocompleteRequestError("Request denied: too many concurrent requests.")
+        # bodies after a modification are out of date
+        limit = min(offset, self.modified.get(buffer_id, offset))
 
-        # prevent duplicate requests
-        if request in self.current_requests:
-            raise AutocompleteRequestError(
-                "Request denied: completion for \"{request}\" "
-                "already in progress.".format(request=request)
-            )
+        chunks = []
+        pos = 0
+        for begin, end in bodies:
+            if end > limit:
+                break
+            chunks.append(text[pos:begin])
+            pos = end
 
-        # start request
-        self.current_requests.add(request)
+        if pos == 0:
+            return None
 
-        # get completion command
-        cmd = self.get_completion_cmd(view, text, offset)
+        chunks.append(text[pos:offset])
+        text = "".join(chunks)
+        return text, len(text)
 
-        # run completion command
-        p = Popen(cmd, shell=True, stdout=PIPE, stderr=STDOUT)
-        parser = ijson.parse(p.stdout)
-        completions = list(self._parse_completions(parser, included=included))
 
-        # finish request
-        self.current_requests.discard(request)
+    def _wait_for_request(self, view, engine, request, query_id):
+        """Wait for a completion request, and update the completions if
+        they changed and the autocomplete window is still open.
+        """
+        try:
+            # short waits, so that a connection to the server does
+            # not outlast the socket timeout of the client
+            changed = None
+            while changed is None:
+                changed = engine.wait(request, 1.0)
+        except (OSError, server.CompletionServerError) as e:
+            print("SwiftKitten: completion request failed:", e)
+            return
 
-        return completions
+        self._update_breaker_status(view)
 
+        if changed and self.query_id == query_id:
+            self.answers.pop(view.buffer_id(), None)
+            self._show_completions(view)
 
-    def _autocomplete_framework(self, view, framework):
+
+    def _show_completions(self, view):
+        """Reopen the autocomplete window with updated completions.
         """
+        view.run_command("hide_auto_complete")
+        view.run_command("auto_complete", {
+            "disable_auto_insert": True,
+            "api_completions_only": False,
+            "next_completion_if_showing": False,
+            "auto_complete_commit_on_tab": True,
+        })
+
+
+    def _wait_for_request_async(self, view, engine, request, query_id):
         """
-        try:
-            text = "import " + framework + "; "
+        """
+        # curry wait with query data
+        _wait_for_request = functools.partial(self._wait_for_request,
+            view, engine, request, query_id)
+        worker = threading.Thread(target=_wait_for_request).start()
 
-            def included(item):
-                return item["context"] == "source.codecompletion.context.othermodule" and \
-                       item["moduleName"] != "Swift"
 
-            completions = self._autocomplete_request(view, self.framework_cache,
-                "."+framework, text, len(text), included=included)
+    def _extract_frameworks(self, view, text):
+        """Extract import framework statements from text.
 
-        except AutocompleteRequestError as e:
-            print(e)
+        Returns a list of (framework, begin, end) tuples.
+        """
+        frameworks = []
 
-        else:
-            self.framework_cache[framework] = completions
+        for match in self.import_prog.finditer(text):
+            if view.score_selector(match.start(), "keyword.other.import.swift"):
+                frameworks.append((match.group(2), match.start(), match.end()))
 
+        return frameworks
 
-    def _autocomplete(self, view, text, offset, stub, query_id):
-        """Request autocomplete data from SourceKitten.
+
+    def _update_imports(self, view):
+        """Keep the imports of a buffer valid across a modification.
+
+        Typing a character after the last import statement cannot change
+        the imports, so the entry is carried over to the new change count.
+        Anything else (pastes, deletions, edits above or on an import
+        line) drops the entry, and the buffer is rescanned on the next
+        completion query.
         """
         buffer_id = view.buffer_id()
-        cache = self.cache[buffer_id]
-        sel = view.sel()
-
-        try:
-            completions = self._autocomplete_request(view, cache,
-                stub, text, offset)
+        entry = self.imports.get(buffer_id)
 
-        except AutocompleteRequestError as e:
-            print(e)
+        if entry is None:
+            return
 
+        sel = view.sel()
+        size = view.size()
+        end = entry["frameworks"][-1][2] if entry["frameworks"] else 0
+
+        def unchanged(region):
+            pos = region.begin()
+            line = view.substr(view.line(pos))
+            return pos > end and "import" not in line
+
+        if abs(size - entry["size"]) <= len(sel) and all(map(unchanged, sel)):
+            entry["change_count"] = view.change_count()
+            entry["size"] = size
+            entry["text"] = None
         else:
-            # update cache timestamp if nothing has changed
-            if stub in cache and completions == cache[stub]["completions"]:
-                cache[stub]["timestamp"] = time.time()
-                return
+            del self.imports[buffer_id]
 
-            # cache completions for this buffer associated with stub
-            cache[stub] = {
-                "completions" : completions,
-                "timestamp"   : time.time()
+
+    def _get_imports_entry(self, view):
+        """Get the imports of a buffer, rescanning it if it has changed.
+        """
+        buffer_id = view.buffer_id()
+        change_count = view.change_count()
+        entry = self.imports.get(buffer_id)
+
+        # rescan buffer for import statements
+        if entry is None or entry["change_count"] != change_count:
+            text = view.substr(Region(0, view.size()))
+            entry = self.imports[buffer_id] = {
+                "change_count" : change_count,
+                "size"         : len(text),
+                "frameworks"   : self._extract_frameworks(view, text),
+                "text"         : None
             }
 
-            # update completions if in the autocomplete window still open
-            if self.query_id == query_id:
-                view.run_command("hide_auto_complete")
-                view.run_command("auto_complete", {
-                    "disable_auto_insert": True,
-                    "api_completions_only": False,
-                    "next_completion_if_showing": False,
-                    "auto_complete_commit_on_tab": True,
-                })
+        return entry
 
 
-    def _serialize_token(self, pair):
-        """Get string representation of (token, value) pair.
+    def _get_imports(self, view, offset):
+        """Get framework names imported before offset, and the text up to
+        offset with import statements replaced with whitespace.
         """
-        from pygments.token import Token
-        token, value = pair
-        # for literals, autocomplete only depends
-        # on type of argument, not the value
-        if token in [Token.Literal.Number.Float,
-                     Token.Literal.Number.Integer,
-                     Token.Literal.String]:
-            return str(token)
-        else:
-            return value
+        entry = self._get_imports_entry(view)
+        frameworks = [f for f in entry["frameworks"] if f[2] <= offset]
 
+        # strip import statements from text
+        if entry["text"] is None or entry["text"][0] != offset:
+            text = view.substr(Region(0, offset))
+            for framework, begin, end in frameworks:
+                text = text[:begin] + " " * (end - begin) + text[end:]
+            entry["text"] = (offset, text)
 
-    def _autocomplete_async(self, view, text, offset, stub, query_id):
-        """
-        """
-        # curry autocomplete request with query data
-        _autocomplete = functools.partial(self._autocomplete, view, text, offset, stub, query_id)
-        worker = threading.Thread(target=_autocomplete).start()
+        return [f[0] for f in frameworks], entry["text"][1]
 
 
-    def _autocomplete_framework_async(self, view, framework):
+    def _format_symbol(self, symbol):
         """
         """
-        # curry autocomplete request with query data
-        _autocomplete_framework = functools.partial(self._autocomplete_framework, view, framework)
-        worker = threading.Thread(target=_autocomplete_framework).start()
+        name = symbol["name"]
+        kind = symbol["kind"].replace("source.lang.swift.decl.", "")
+        hint = symbol["typename"] or kind.split(".")[0]
+
+        # functions are named `foo(bar:baz:)`
+        if name.endswith(":)"):
+            base, labels = name[:-2].split("(", 1)
+            args = []
+            for index, label in enumerate(labels.split(":"), 1):
+                arg = "${%s:%s}" % (index, label)
+                args.append(arg if label == "_" else label + ": " + arg)
+            snippet = base + "(" + ", ".join(args) + ")"
+        else:
+            snippet = name
 
+        return [name + "\t" + hint, snippet]
 
-    def _extract_frameworks(self, view, text):
-        """Extract import framework statements from text, replacing with whitespace.
+
+    def _get_local_completions(self, view, prefix, offset):
+        """Get completions for symbols declared in the buffer which are
+        visible at offset.
         """
-        frameworks = []
+        symbols = self.symbols.get(view.buffer_id(), [])
+        completions = []
 
-        def repl(match):
-            if view.score_selector(match.start(), "keyword.other.import.swift"):
-                frameworks.append(match.group(2))
-                return " " * len(match.group(0))
-            else:
-                return match.group(0)
+        for symbol in symbols:
+            scope = symbol["scope"]
+            if scope is not None and not (scope[0] <= offset <= scope[1]):
+                continue
+            if symbol["name"].startswith(prefix):
+                completions.append(self._format_symbol(symbol))
 
-        text = re.sub("import(\s+)(\w+)", repl, text)
-        return frameworks, text
+        return completions
 
 
-    def _match_prefix(self, prefix, item):
+    def _get_index_completions(self, view, prefix):
+        """Get completions for file scope symbols declared in other files
+        of the project.
         """
-        """
-        return item[0].startswith(prefix)
+        index = self._get_index(view)
+        completions = []
+
+        if index is not None:
+            for name, kind, typename, line, toplevel in \
+                    index.toplevel_symbols(view.file_name()):
+                if name.startswith(prefix):
+                    symbol = {"name": name, "kind": kind, "typename": typename}
+                    completions.append(self._format_symbol(symbol))
+
+        return completions
 
 
     def on_query_completions(self, view, prefix, locations):
         """Sublime autocomplete query.
+
+        Completions are computed in phases, see `_completion_phases`. If
+        they take longer than `completion_budget` ms, the best answer so
+        far is returned, and the remaining phases finish in a worker
+        thread, which updates the completions when done.
         """
         buffer_id = view.buffer_id()
         sel = view.sel()
@@ -507,126 +714,578 @@ class SwiftKittenEventListener(sublime_plugin.EventListener):
         # must be made at the start of postfix '.'
         offset = pos - len(prefix)
 
-        if buffer_id not in self.cache:
-            self.cache[buffer_id] = {}  # initalize cache for buffer
+        budget = self.get_settings(view, "completion_budget", 50)
+        deadline = time.time() + budget / 1000.0
+        cpflags = self.get_completion_flags(view)
+
+        # answer of a query at the same position and change count
+        key = (view.change_count(), offset, prefix)
+        answer = self.answers.get(buffer_id)
+        if answer is not None and answer["key"] == key:
+            completions = answer["completions"]
+            return (completions, cpflags) if cpflags else completions
 
         # create a unique id for this autocomplete request
         self.query_id = str(uuid.uuid1())
 
+        query = {
+            "id"          : self.query_id,
+            "key"         : key,
+            "stub"        : None,
+            "completions" : []
+        }
+
+        phases = self._completion_phases(view, prefix, offset, query)
+
+        for phase in phases:
+            if time.time() > deadline:
+                SwiftKittenEventListener.budget_overruns += 1
+                completions = self._best_answer(buffer_id, query)
+
+                # finish the remaining phases asynchronously
+                _finish_query = functools.partial(self._finish_query, view, phases, query)
+                threading.Thread(target=_finish_query).start()
+                break
+        else:
+            completions = query["completions"]
+
+        # return completions
+        return (completions, cpflags) if cpflags else completions
+
+
+    def _call_engine(self, engine, method, *params):
+        """Call an engine method. If the completion server fails, the
+        engine in the plugin host is called instead.
+
+        Returns the engine which answered, and the result.
+        """
+        try:
+            return engine, getattr(engine, method)(*params)
+        except (OSError, server.CompletionServerError) as e:
+            if engine is self.engine:
+                raise
+
+            print("SwiftKitten: completion server failed:", e)
+
+            # remove stale socket, so that the server is restarted
+            if isinstance(e, ConnectionRefusedError) and os.path.exists(engine.path):
+                os.unlink(engine.path)
+
+            return self.engine, getattr(self.engine, method)(*params)
+
+
+    def _completion_phases(self, view, prefix, offset, query):
+        """Compute the completions of a query, yielding between phases.
+
+        The completions are stored in query["completions"], and in
+        `answers` when all phases are done.
+        """
+        buffer_id = view.buffer_id()
+        engine = self.get_engine(view)
+        options = self.get_engine_options(view)
+        completions = query["completions"]
+
         # parse stub, for example:
         #   foo.         -> foo
-        #   foo(bar).baz -> foo(baz)
-        #   (foo + bar). -> (foo + bar)
-        text = view.substr(Region(0, offset))
-        stub = get_autocomplete_stub(self.lexer, text)
+        #   foo(bar).baz -> foo(bar)
+        #   (foo + bar). -> (foo+bar)
+        # from whole lines at the end of the text before offset
+        begin = max(offset - self.stub_context, 0)
+        tail = view.substr(Region(begin, offset))
+        if begin > 0:
+            tail = tail[tail.find("\n") + 1:]
+        canonicalization = self.get_settings(view, "stub_canonicalization", {})
 
-        # serialize stub
-        stub = "".join(map(self._serialize_token, stub))
+        engine, (stub, raw_stub) = self._call_engine(engine, "get_stub",
+            tail, canonicalization)
 
-        # initalize completion info
-        completions = []
-        cpflags = self.get_completion_flags(view)
+        query["stub"] = stub
+        yield "stub"
 
         # remove import framework statements if stub is empty
         # and extract framework names. global variables imported
         # from frameworks are stored in a separate cache
+        text = None
         if stub == "":
             excluded_frameworks = self.get_settings(view, "exclude_framework_globals", [])
-            match_prefix = functools.partial(self._match_prefix, prefix)
-            frameworks, text = self._extract_frameworks(view, text)
+            frameworks, text = self._get_imports(view, offset)
+            frameworks = [f for f in frameworks if f not in excluded_frameworks]
+            engine, framework_completions = self._call_engine(engine,
+                "complete_frameworks", frameworks, prefix, options)
+            completions += framework_completions
+
+            # SourceKitten only sees this file, so symbols
+            # from other files come from the project index
+            completions += self._get_index_completions(view, prefix)
+
+            yield "frameworks"
+
+        # get cached completions, and request completions if out of
+        # date, only then getting the text of the request
+        engine, result = self._call_engine(engine, "complete",
+            buffer_id, stub, raw_stub, None, offset, options)
+        completions += result["completions"]
+
+        # answer from the local symbol table until
+        # the completion request has finished
+        if stub == "" and not result["cached"]:
+            completions += self._get_local_completions(view, prefix, offset)
+
+        if result["outdated"]:
+            if text is None:
+                text = view.substr(Region(0, offset))
+            reduced = self._slice_text(view, text, offset)
+            engine, request = self._call_engine(engine, "refresh",
+                buffer_id, stub, text, offset, options, reduced)
+
+            if request is not None:
+                self._wait_for_request_async(view, engine, request, query["id"])
+
+        self.answers[buffer_id] = {
+            "key"         : query["key"],
+            "stub"        : stub,
+            "completions" : completions
+        }
+
+
+    def _best_answer(self, buffer_id, query):
+        """Get the best completions for a query which ran out of time:
+        the last answer at the same offset, if it is for the same stub,
+        or the completions computed so far.
+        """
+        answer = self.answers.get(buffer_id)
 
-            for framework in frameworks:
-                if framework not in excluded_frameworks:
+        if answer is not None and answer["key"][1] == query["key"][1] and \
+                query["stub"] in (None, answer["stub"]):
+            return answer["completions"]
 
-                    if framework in self.framework_cache:
-                        # disable fuzzy matching for globals
-                        completions += filter(match_prefix, self.framework_cache[framework])
-                    else:
-                        self._autocomplete_framework_async(view, framework)
+        return list(query["completions"])
 
-        # check if stub is cached
-        if stub in self.cache[buffer_id]:
-            completions += self.cache[buffer_id][stub]["completions"]
 
-            # check timestamp
-            now = time.time()
-            timestamp = self.cache[buffer_id][stub]["timestamp"]
-            cache_timeout = self.get_settings(view, "cache_timeout", 1.0)
+    def _finish_query(self, view, phases, query):
+        """Run the remaining phases of a query, and update the completions
+        if the autocomplete window is still open.
+        """
+        try:
+            for phase in phases:
+                pass
+        except Exception as e:
+            print("SwiftKitten: completion query failed:", e)
+            return
 
-            # if cached completion data still valid, do not make request
-            if (now - timestamp) > cache_timeout:
-                self._autocomplete_async(view, text, offset, stub, self.query_id)
+        if self.query_id == query["id"]:
+            self._show_completions(view)
 
-        else:
-            # request completions
-            self._autocomplete_async(view, text, offset, stub, self.query_id)
 
-        # return completions
-        return (completions, cpflags) if cpflags else completions
 
 
 
 
-
-def get_tokens_reversed(lexer, text):
+def get_char_offset(text):
+    """Get a function converting SourceKitten byte offsets in text
+    to character offsets.
     """
+    data = text.encode("utf-8")
+
+    if len(data) == len(text):
+        return lambda offset: offset
+
+    # byte and character offsets of the start of each line, so that
+    # only the line containing an offset is decoded
+    byte_starts, char_starts = [0], [0]
+    for line in text.splitlines(True):
+        byte_starts.append(byte_starts[-1] + len(line.encode("utf-8")))
+        char_starts.append(char_starts[-1] + len(line))
+
+    def char_offset(offset):
+        line = bisect.bisect_right(byte_starts, offset) - 1
+        begin = byte_starts[line]
+        return char_starts[line] + len(data[begin:offset].decode("utf-8", "ignore"))
+
+    return char_offset
+
+
+
+def get_symbols(structure, text):
+    """Get a flat list of declarations from structure info.
+
+    Each symbol is a dict with the name, kind, type name and offset of
+    the declaration, and the scope in which it is visible, as a (begin,
+    end) tuple of the enclosing declaration body, or None at file scope.
+    Named entries which are not declarations, such as calls and their
+    arguments, are skipped.
     """
-    lines = text.splitlines()
-    for line in lines[::-1]:
-        tokens = reversed(list(lexer.get_tokens(line)))
-        yield from tokens
+    symbols = []
+    char_offset = get_char_offset(text)
+
+    def visit(entries, scope):
+        for entry in entries:
+            kind = entry.get("key.kind", "")
+            if "key.name" in entry and kind.startswith("source.lang.swift.decl."):
+                symbols.append({
+                    "name"     : entry["key.name"],
+                    "kind"     : kind,
+                    "typename" : entry.get("key.typename", ""),
+                    "offset"   : char_offset(entry.get("key.offset", 0)),
+                    "scope"    : scope
+                })
 
+            if "key.bodyoffset" in entry:
+                begin = entry["key.bodyoffset"]
+                end = begin + entry.get("key.bodylength", 0)
+            else:
+                begin = entry.get("key.offset", 0)
+                end = begin + entry.get("key.length", 0)
+
+            visit(entry.get("key.substructure", []),
+                (char_offset(begin), char_offset(end)))
+
+    visit(structure.get("key.substructure", []), None)
+    return symbols
 
 
-def get_autocomplete_stub(lexer, text):
+
+def get_bodies(structure, text):
+    """Get the outermost function bodies from structure info, as a sorted
+    list of (begin, end) character offsets.
     """
+    bodies = []
+    char_offset = get_char_offset(text)
+
+    def visit(entries):
+        for entry in entries:
+            kind = entry.get("key.kind", "")
+            if ".decl.function." in kind and "key.bodyoffset" in entry:
+                begin = entry["key.bodyoffset"]
+                end = begin + entry.get("key.bodylength", 0)
+                bodies.append((char_offset(begin), char_offset(end)))
+            else:
+                visit(entry.get("key.substructure", []))
+
+    visit(structure.get("key.substructure", []))
+    return sorted(bodies)
+
+
+
+class TimerWheel(object):
+    """Timers keyed by, e.g., buffer id, where scheduling a key again
+    replaces its pending timer.
+
+    Timers are kept in a ring of slots, one per `resolution` ms. A single
+    callback started with `set_timeout` advances the ring while there are
+    pending timers.
     """
-    entity = []
 
-    from pygments.token import Token
+    def __init__(self, set_timeout, resolution=50, size=64):
+        """
+        """
+        self.set_timeout = set_timeout
+        self.resolution = resolution
+        self.lock = threading.Lock()
+        self.position = 0
+        self.running = False
+
+        # each slot maps key -> (rounds left, callback)
+        self.slots = [{} for i in range(size)]
 
-    # ignored tokens
-    ignored = [Token.Comment, Token.Text, Token.Text.Whitespace, Token.Comment.Single]
-    filtered = lambda pair: pair[0] not in ignored  # pair = (token,value)
+        # key -> slot
+        self.timers = {}
 
-    tokens = filter(filtered, get_tokens_reversed(lexer, text))
-    blocks = get_blocks(tokens)
-    block = next(blocks, [])
 
-    if len(block) == 1 and block[0][1] == ".":
-        block = next(blocks, [])
+    def schedule(self, key, delay, callback):
+        """Call callback after delay ms, unless key is scheduled again.
+        """
+        ticks = max(1, int(round(delay / self.resolution)))
+        rounds = (ticks - 1) // len(self.slots)
+
+        with self.lock:
+            self._cancel(key)
+            slot = (self.position + ticks) % len(self.slots)
+            self.slots[slot][key] = (rounds, callback)
+            self.timers[key] = slot
 
-        if len(block) > 0 and block[0][1] == "(":
-            block_ = next(blocks, [])
+            start = not self.running
+            self.running = True
 
-            if len(block_) == 1 and block[0][0] is Token.Name:
-                return block_ + block
+        if start:
+            self.set_timeout(self.tick, self.resolution)
 
-        return block
 
-    return []
+    def cancel(self, key):
+        """
+        """
+        with self.lock:
+            self._cancel(key)
 
 
+    def _cancel(self, key):
+        """
+        """
+        slot = self.timers.pop(key, None)
+        if slot is not None:
+            del self.slots[slot][key]
 
-def get_blocks(tokens):
-    """
+
+    def tick(self):
+        """Advance to the next slot and run its due callbacks.
+        """
+        due = []
+
+        with self.lock:
+            self.position = (self.position + 1) % len(self.slots)
+            slot = self.slots[self.position]
+
+            for key, (rounds, callback) in list(slot.items()):
+                if rounds == 0:
+                    del slot[key]
+                    del self.timers[key]
+                    due.append(callback)
+                else:
+                    slot[key] = (rounds - 1, callback)
+
+            running = self.running = len(self.timers) > 0
+
+        if running:
+            self.set_timeout(self.tick, self.resolution)
+
+        for callback in due:
+            try:
+                callback()
+            except Exception as e:
+                print("SwiftKitten:", e)
+
+
+
+
+
+
+class SwiftKittenIndex(object):
+    """Index of the declarations in the Swift files of a window's folders.
+
+    Files are indexed in the background by running `sourcekitten structure`
+    on a pool of workers, one SourceKitten process each. A file is only
+    reindexed when its modification time and contents have changed. The
+    index is saved to the SwiftKitten cache folder, one file for each set
+    of folders.
     """
-    block = []
-    level = 0
 
-    from pygments.token import Token
+    # indexes by window id
+    indexes = {}
+
+
+    def __init__(self, folders):
+        """
+        """
+        self.folders = sorted(folders)
+        self.lock = threading.Lock()
+        self.running = False
+        self.indexed = False
+        self.queued = set()
+
+        # path -> (mtime, hash, symbols), where each symbol is a
+        # (name, kind, typename, line, toplevel) tuple
+        self.files = {}
+
+        # base name -> [(path, symbol)]
+        self.names = {}
 
-    for token, value in tokens:
-        block.append((token,value))
+        key = hashlib.sha1("\n".join(self.folders).encode("utf-8")).hexdigest()
+        self.path = os.path.join(SwiftKittenEventListener._get_cache_path(),
+            "index", key + ".index")
 
-        if value == ")":
-            level += 1
-        elif value == "(":
-            level -= 1
+        self.load()
 
-        if level == 0:
-            yield block[::-1]
-            block = []
+
+    @classmethod
+    def get(cls, window):
+        """Get the index for a window, creating it if its folders changed.
+        """
+        folders = window.folders()
+        index = cls.indexes.get(window.id())
+
+        if index is None or index.folders != sorted(folders):
+            index = cls.indexes[window.id()] = cls(folders)
+
+        return index
+
+
+    def load(self):
+        """
+        """
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "rb") as f:
+                    self.files = pickle.loads(zlib.decompress(f.read()))
+            except Exception as e:
+                print("SwiftKitten: failed to load index:", e)
+                self.files = {}
+
+        self._update_names()
+
+
+    def save(self):
+        """
+        """
+        index_path = os.path.dirname(self.path)
+
+        if not os.path.exists(index_path):
+            os.makedirs(index_path)
+
+        with self.lock:
+            data = pickle.dumps(self.files, pickle.HIGHEST_PROTOCOL)
+
+        with open(self.path, "wb") as f:
+            f.write(zlib.compress(data))
+
+
+    def _update_names(self):
+        """
+        """
+        names = {}
+
+        with self.lock:
+            for path, (mtime, digest, symbols) in self.files.items():
+                for symbol in symbols:
+                    name = symbol[0].split("(")[0]
+                    names.setdefault(name, []).append((path, symbol))
+
+        self.names = names
+
+
+    def lookup(self, name):
+        """Find declarations named `name` in all indexed files.
+
+        Returns a list of (path, symbol) tuples.
+        """
+        return self.names.get(name, [])
+
+
+    def toplevel_symbols(self, excluded_path=None):
+        """Iterate over file scope declarations of all indexed files.
+        """
+        with self.lock:
+            files = list(self.files.items())
+
+        for path, (mtime, digest, symbols) in files:
+            if path != excluded_path:
+                for symbol in symbols:
+                    if symbol[4]:
+                        yield symbol
+
+
+    def find_files(self):
+        """Find Swift files in the folders, skipping hidden directories.
+        """
+        for folder in self.folders:
+            for root, dirs, files in os.walk(folder):
+                dirs[:] = [d for d in dirs if not d.startswith(".")]
+                for name in files:
+                    if name.endswith(".swift"):
+                        yield os.path.join(root, name)
+
+
+    def index_file(self, binary, path, timeout=None):
+        """Index a single file, unless it is unchanged.
+
+        Returns True if the index was modified, or None if SourceKitten
+        failed, e.g. while indexing is paused by its circuit breaker.
+        """
+        try:
+            mtime = os.path.getmtime(path)
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return False
+
+        entry = self.files.get(path)
+        if entry is not None and entry[0] == mtime:
+            return False
+
+        digest = hashlib.sha1(data).hexdigest()
+        if entry is not None and entry[1] == digest:
+            with self.lock:
+                self.files[path] = (mtime, digest, entry[2])
+            return True
+
+        cmd = "{sourcekitten_binary} structure --file {path}".format(
+            sourcekitten_binary=binary,
+            path=shlex.quote(path)
+        )
+
+        try:
+            structure = core.run_sourcekitten("index", cmd,
+                lambda f: core.read_structure(ijson.parse(f)), timeout)
+        except core.SourceKittenError as e:
+            print("SwiftKitten: indexing {path} failed: {error}".format(
+                path=path, error=e))
+            return None
+
+        text = data.decode("utf-8", "replace")
+        symbols = []
+
+        for symbol in get_symbols(structure, text):
+            kind = symbol["kind"].replace("source.lang.swift.decl.", "")
+            line = text.count("\n", 0, symbol["offset"]) + 1
+            toplevel = symbol["scope"] is None
+            symbols.append((symbol["name"], kind, symbol["typename"], line, toplevel))
+
+        with self.lock:
+            self.files[path] = (mtime, digest, tuple(symbols))
+
+        return True
+
+
+    def update(self, binary, workers, paths=None, timeout=None):
+        """Index files in the background. If paths is None, index all Swift
+        files in the folders and drop files which no longer exist.
+        """
+        with self.lock:
+            if self.running:
+                if paths is not None:
+                    self.queued.update(paths)
+                return
+            self.running = True
+
+        def index_files():
+            try:
+                files = list(self.find_files()) if paths is None else paths
+                modified = False
+                failed = False
+
+                if paths is None:
+                    with self.lock:
+                        removed = set(self.files) - set(files)
+                        for path in removed:
+                            del self.files[path]
+                    modified = len(removed) > 0
+
+                with futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                    index_file = functools.partial(self.index_file, binary,
+                        timeout=timeout)
+                    for result in executor.map(index_file, files):
+                        modified = modified or bool(result)
+                        failed = failed or result is None
+
+                if modified:
+                    self._update_names()
+                    self.save()
+
+                # files which failed are retried on the next update
+                if paths is None and not failed:
+                    self.indexed = True
+
+            except Exception as e:
+                print("SwiftKitten: indexing failed:", e)
+
+            finally:
+                with self.lock:
+                    self.running = False
+                    queued, self.queued = list(self.queued), set()
+
+                if queued:
+                    self.update(binary, workers, queued, timeout)
+
+        threading.Thread(target=index_files).start()
 
 
 
@@ -638,8 +1297,72 @@ class swift_kitten_clear_cache_command(sublime_plugin.TextCommand):
     def run(self, edit):
         """Manually clear completion cache.
         """
-        SwiftKittenEventListener.cache = {}
-        SwiftKittenEventListener.framework_cache = {}
+        SwiftKittenEventListener.shared_instance.get_engine(self.view).clear_cache()
+
+
+
+
+
+class swift_kitten_show_stats_command(sublime_plugin.TextCommand):
+
+    def run(self, edit):
+        """Report completion cache statistics.
+        """
+        stats = SwiftKittenEventListener.shared_instance.get_engine(self.view).get_stats()
+        queries = max(stats["queries"], 1)
+        hit_rate = stats["hits"] / queries
+        raw_hit_rate = (stats["hits"] - stats["canonical_hits"]) / queries
+
+        message = ("SwiftKitten: {queries} queries, {hit_rate:.1%} cache hits "
+            "({raw_hit_rate:.1%} without stub canonicalization), "
+            "{overruns} over completion budget, "
+            "{disk_hits} from the persistent cache").format(
+            queries=stats["queries"],
+            disk_hits=stats.get("disk_hits", 0),
+            hit_rate=hit_rate,
+            raw_hit_rate=raw_hit_rate,
+            overruns=SwiftKittenEventListener.budget_overruns
+        )
+
+        print(message)
+        sublime.status_message(message)
+
+
+
+
+
+
+class swift_kitten_goto_symbol_command(sublime_plugin.TextCommand):
+
+    def run(self, edit):
+        """Go to the declaration of the word under the cursor, looked up
+        in the project index.
+        """
+        view = self.view
+        window = view.window()
+        sel = view.sel()
+
+        if len(sel) == 0 or window is None:
+            return
+
+        query = view.substr(view.word(sel[0].a))
+        results = SwiftKittenIndex.get(window).lookup(query)
+
+        if len(results) == 0:
+            sublime.status_message("SwiftKitten: no declaration of \"%s\" found." % query)
+            return
+
+        def open_result(index):
+            if index >= 0:
+                path, symbol = results[index]
+                window.open_file("%s:%s" % (path, symbol[3]), sublime.ENCODED_POSITION)
+
+        if len(results) == 1:
+            open_result(0)
+        else:
+            items = [[symbol[0], "%s:%s" % (path, symbol[3])] for path, symbol in results]
+            window.show_quick_panel(items, open_result)
+
 
 
 
@@ -731,7 +1454,7 @@ class swift_kitten_display_documentation_command(sublime_plugin.TextCommand):
         # run docsetutil command
         docset = SwiftKittenEventListener.get_settings(view, "docset")
         cmd = self.get_docsetutil_cmd(view, docset, query)
-        results = check_output(cmd, stderr=STDOUT)
+        results = subprocess.check_output(cmd, stderr=subprocess.STDOUT)
         results = str(results, 'utf-8')
 
         if len(results) == 0:
@@ -9,14 +9,46 @@ Main API:
 - ``ijson.items``: iterator returning Python objects found under a specified prefix,
   see ``ijson.common.items`` for docs.
 
+- ``ijson.kvitems``: iterator returning ``(key, object)`` pairs of the maps
+  found under a specified prefix, see ``ijson.common.kvitems`` for docs.
+
+- ``ijson.items_multi``: iterator returning ``(prefix, object)`` for Python
+  objects found under any of several prefixes, see ``ijson.common.items_multi``
+  for docs.
+
+- ``ijson.columns``: typed columns of the values found under a specified
+  prefix, or of fields of the maps found there, see ``ijson.common.columns``
+  for docs.
+
+- ``ijson.parse_buffer``: like ``ijson.parse`` for a document already in
+  memory, in bytes, a bytearray, a memoryview or an mmap.
+
+- ``ijson.parse_file_mmap``: like ``ijson.parse_buffer`` for a file mapped
+  into memory.
+
+- ``ijson.Parser``: push parser returning the events of the chunks fed to it,
+  for input which is not read from a file.
+
+- ``ijson.Selector``: a path selector with wildcards, which ``ijson.items``
+  accepts instead of a prefix and ``ijson.parse`` as ``selector``, see
+  ``ijson.common.Selector`` for docs.
+
 Top-level ``ijson`` module exposes method from the pure Python backend. There's
 also two other backends using the C library yajl in ``ijson.backends`` that have
 the same API and are faster under CPython.
 '''
-from ijson.common import JSONError, IncompleteJSONError, ObjectBuilder
+from ijson.common import JSONError, IncompleteJSONError, ObjectBuilder, Selector, \
+                         StringColumn
 import ijson.backends.python as backend
 
 
 basic_parse = backend.basic_parse
+basic_parse_buffer = backend.basic_parse_buffer
 parse = backend.parse
+parse_buffer = backend.parse_buffer
+parse_file_mmap = backend.parse_file_mmap
 items = backend.items
+kvitems = backend.kvitems
+items_multi = backend.items_multi
+columns = backend.columns
+Parser = backend.Parser
@@ -0,0 +1,96 @@
+'''
+Asynchronous versions of ``basic_parse``, ``parse`` and ``items`` for input
+read from an object with a coroutine ``read`` method, like
+``asyncio.StreamReader``.
+
+They are async generators and need Python 3.6, so this module is not
+imported by ``ijson`` and has to be imported explicitly::
+
+    from ijson.aio import items_async
+
+    async for city in items_async(reader, 'earth.europe.item'):
+        # ...
+
+Input is read in chunks of ``buf_size`` bytes, by default the ``BUFSIZE`` of
+the backend, and pushed to its ``Parser``. Control returns to the event loop
+after each chunk, so parsing a large document which is already buffered
+doesn't hold it up.
+'''
+import asyncio
+from collections import deque
+
+from ijson import common
+import ijson.backends.python as python
+
+
+async def _batches(file, backend, buf_size, config):
+    # yields the events of each chunk as one list
+    backend = backend or python
+    parser = backend.Parser(**config)
+    buf_size = buf_size or backend.BUFSIZE
+    while True:
+        data = await file.read(buf_size)
+        events = parser.feed(data) if data else parser.close()
+        if events:
+            yield events
+        if not data:
+            break
+        await asyncio.sleep(0)
+
+
+async def basic_parse_async(file, backend=None, buf_size=None, **config):
+    '''
+    Async iterator yielding unprefixed events, see ``basic_parse`` of the
+    backends.
+
+    Parameters:
+
+    - file: an object with a coroutine ``read(size)`` returning bytes
+    - backend: a backend module, the pure Python one by default
+    - buf_size: a size of an input buffer, ``backend.BUFSIZE`` by default
+    - config: keyword arguments of ``backend.Parser``
+    '''
+    async for events in _batches(file, backend, buf_size, config):
+        for event in events:
+            yield event
+
+
+async def parse_async(file, backend=None, buf_size=None, tuple_paths=False,
+                      **config):
+    '''
+    Async iterator yielding prefixed events, see ``ijson.common.parse``.
+    Parameters are those of ``basic_parse_async``.
+    '''
+    # common.parse yields exactly one prefixed event for each basic event,
+    # so it is pulled once for each event put in the queue
+    pending = deque()
+    prefixed = common.parse(iter(pending.popleft, None), tuple_paths)
+    async for events in _batches(file, backend, buf_size, config):
+        pending.extend(events)
+        for _ in range(len(events)):
+            yield next(prefixed)
+
+
+async def items_async(file, prefix, backend=None, buf_size=None, **config):
+    '''
+    Async iterator yielding native Python objects found under a prefix, see
+    ``ijson.common.items``. A tuple prefix selects tuple paths. Other
+    parameters are those of ``basic_parse_async``.
+    '''
+    builder = None
+    tuple_paths = isinstance(prefix, tuple)
+    async for current, event, value in parse_async(file, backend, buf_size,
+                                                   tuple_paths, **config):
+        if builder is not None:
+            if current == prefix and event == end_event:
+                yield builder.value
+                builder = None
+            else:
+                builder.event(event, value)
+        elif current == prefix:
+            if event in ('start_map', 'start_array'):
+                builder = common.ObjectBuilder()
+                builder.event(event, value)
+                end_event = event.replace('start', 'end')
+            else:
+                yield value
@@ -40,3 +40,56 @@ def find_yajl_cffi(ffi, required):
         raise YAJLImportError('Unable to load YAJL.')
     require_version(yajl.yajl_version(), required)
     return yajl
+
+def ctypes_chunks(buffer, size):
+    '''
+    Yields ctypes arrays of at most 'size' bytes sharing the memory of a
+    bytes-like object, which C functions take as pointers without the
+    contents being copied. Read-only objects other than bytes are copied
+    once.
+    '''
+    from ctypes import c_char, c_char_p, c_void_p, addressof, cast
+
+    # the length of a memoryview or an array counts items, not bytes
+    if not isinstance(buffer, bytes):
+        view = memoryview(buffer)
+        if view.itemsize != 1:
+            buffer = view.cast('B') if hasattr(view, 'cast') else view.tobytes()
+
+    length = len(buffer)
+    if isinstance(buffer, bytes):
+        data = buffer
+        address = cast(c_char_p(buffer), c_void_p).value
+    else:
+        try:
+            data = (c_char * length).from_buffer(buffer)
+        except TypeError:
+            data = (c_char * length).from_buffer_copy(buffer)
+        address = addressof(data)
+    for start in range(0, length, size):
+        yield (c_char * min(size, length - start)).from_address(address + start)
+
+def mmap_events(basic_parse_buffer, path, **config):
+    '''
+    Yields the events of a backend's basic_parse_buffer for the contents of
+    a file mapped into memory, which is unmapped when they are exhausted or
+    the iterator is closed.
+    '''
+    import mmap
+    import os
+
+    with open(path, 'rb') as f:
+        # empty files can't be mapped. The mapping is copy-on-write so that
+        # ctypes can share it, pages are only copied when written to.
+        size = os.fstat(f.fileno()).st_size
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY) if size else b''
+    try:
+        events = basic_parse_buffer(buffer, **config)
+        try:
+            for event in events:
+                yield event
+        finally:
+            events.close()
+    finally:
+        if size:
+            buffer.close()
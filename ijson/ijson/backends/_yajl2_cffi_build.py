@@ -0,0 +1,252 @@
+'''
+Builds ``ijson.backends._yajl2_cffi``, a compiled helper for the yajl2_cffi
+backend which records parse events in C.
+
+Usage::
+
+    python -m ijson.backends._yajl2_cffi_build
+
+YAJL 2.x headers and library should be available to the C compiler. The
+yajl2_cffi backend uses the helper when it has been built, and calls back
+into Python for every event otherwise.
+'''
+
+from cffi import FFI
+
+
+C_SOURCE = """
+#include <limits.h>
+#include <stdlib.h>
+#include <string.h>
+#include <yajl/yajl_parse.h>
+
+/* incremented when the records change, older helpers are not used */
+#define IJSON_BATCH_VERSION 2
+
+enum {
+    IJSON_NULL,
+    IJSON_BOOLEAN,
+    IJSON_NUMBER,
+    IJSON_STRING,
+    IJSON_START_MAP,
+    IJSON_MAP_KEY,
+    IJSON_END_MAP,
+    IJSON_START_ARRAY,
+    IJSON_END_ARRAY
+};
+
+/* the value of an event is data[offset:offset + length], except for
+   booleans which store the value in length, and maps and arrays which
+   store there the number of bytes of the chunk consumed up to their
+   bracket */
+typedef struct {
+    unsigned int type;
+    unsigned int offset;
+    unsigned int length;
+} ijson_event;
+
+typedef struct {
+    ijson_event *events;
+    size_t count;
+    char *data;
+    size_t data_length;
+    int failed;
+    yajl_handle handle;
+    size_t events_size;
+    size_t data_size;
+} ijson_batch;
+
+static int ijson_grow(void **buffer, size_t *size, size_t needed, size_t item)
+{
+    size_t new_size = *size ? *size : 256;
+    void *new_buffer;
+
+    while (new_size < needed)
+        new_size *= 2;
+    new_buffer = realloc(*buffer, new_size * item);
+    if (new_buffer == NULL)
+        return 0;
+    *buffer = new_buffer;
+    *size = new_size;
+    return 1;
+}
+
+static int ijson_append(ijson_batch *batch, unsigned int type,
+                        const void *value, size_t length)
+{
+    ijson_event *event;
+
+    if (batch->count == batch->events_size &&
+        !ijson_grow((void **)&batch->events, &batch->events_size,
+                    batch->count + 1, sizeof(ijson_event)))
+        goto failed;
+
+    if (value != NULL) {
+        if (length > UINT_MAX - batch->data_length)
+            goto failed;
+        if (batch->data_length + length > batch->data_size &&
+            !ijson_grow((void **)&batch->data, &batch->data_size,
+                        batch->data_length + length, 1))
+            goto failed;
+        memcpy(batch->data + batch->data_length, value, length);
+    }
+
+    event = &batch->events[batch->count++];
+    event->type = type;
+    event->offset = (unsigned int)batch->data_length;
+    event->length = (unsigned int)length;
+
+    if (value != NULL)
+        batch->data_length += length;
+    return 1;
+
+failed:
+    batch->failed = 1;
+    return 0;
+}
+
+static int ijson_container(ijson_batch *batch, unsigned int type)
+{
+    return ijson_append(batch, type, NULL,
+                        yajl_get_bytes_consumed(batch->handle));
+}
+
+static int ijson_null(void *ctx)
+{
+    return ijson_append(ctx, IJSON_NULL, NULL, 0);
+}
+
+static int ijson_boolean(void *ctx, int value)
+{
+    return ijson_append(ctx, IJSON_BOOLEAN, NULL, value != 0);
+}
+
+static int ijson_number(void *ctx, const char *value, size_t length)
+{
+    return ijson_append(ctx, IJSON_NUMBER, value, length);
+}
+
+static int ijson_string(void *ctx, const unsigned char *value, size_t length)
+{
+    return ijson_append(ctx, IJSON_STRING, value, length);
+}
+
+static int ijson_start_map(void *ctx)
+{
+    return ijson_container(ctx, IJSON_START_MAP);
+}
+
+static int ijson_map_key(void *ctx, const unsigned char *value, size_t length)
+{
+    return ijson_append(ctx, IJSON_MAP_KEY, value, length);
+}
+
+static int ijson_end_map(void *ctx)
+{
+    return ijson_container(ctx, IJSON_END_MAP);
+}
+
+static int ijson_start_array(void *ctx)
+{
+    return ijson_container(ctx, IJSON_START_ARRAY);
+}
+
+static int ijson_end_array(void *ctx)
+{
+    return ijson_container(ctx, IJSON_END_ARRAY);
+}
+
+/* numbers are always passed as strings, like in the other backends */
+static yajl_callbacks ijson_callbacks = {
+    ijson_null,
+    ijson_boolean,
+    NULL,
+    NULL,
+    ijson_number,
+    ijson_string,
+    ijson_start_map,
+    ijson_map_key,
+    ijson_end_map,
+    ijson_start_array,
+    ijson_end_array
+};
+
+static yajl_handle ijson_alloc(ijson_batch *batch, int allow_comments,
+                               int multiple_values)
+{
+    yajl_handle handle = yajl_alloc(&ijson_callbacks, NULL, batch);
+
+    if (handle == NULL)
+        return NULL;
+    batch->handle = handle;
+    if (allow_comments)
+        yajl_config(handle, yajl_allow_comments, 1);
+    if (multiple_values)
+        yajl_config(handle, yajl_allow_multiple_values, 1);
+    return handle;
+}
+
+static void ijson_reset(ijson_batch *batch)
+{
+    batch->count = 0;
+    batch->data_length = 0;
+}
+
+static void ijson_free(ijson_batch *batch)
+{
+    free(batch->events);
+    free(batch->data);
+    batch->events = NULL;
+    batch->data = NULL;
+    batch->count = batch->events_size = 0;
+    batch->data_length = batch->data_size = 0;
+}
+"""
+
+
+CDEF = """
+#define IJSON_BATCH_VERSION ...
+
+typedef struct yajl_handle_t * yajl_handle;
+typedef enum {
+    yajl_status_ok,
+    yajl_status_client_canceled,
+    yajl_status_error
+} yajl_status;
+
+typedef struct {
+    unsigned int type;
+    unsigned int offset;
+    unsigned int length;
+} ijson_event;
+
+typedef struct {
+    ijson_event *events;
+    size_t count;
+    char *data;
+    size_t data_length;
+    int failed;
+    ...;
+} ijson_batch;
+
+yajl_handle ijson_alloc(ijson_batch *batch, int allow_comments,
+                        int multiple_values);
+void ijson_reset(ijson_batch *batch);
+void ijson_free(ijson_batch *batch);
+
+yajl_status yajl_parse(yajl_handle hand, const unsigned char *jsonText, size_t jsonTextLength);
+yajl_status yajl_complete_parse(yajl_handle hand);
+unsigned char* yajl_get_error(yajl_handle hand, int verbose, const unsigned char *jsonText, size_t jsonTextLength);
+void yajl_free_error(yajl_handle hand, unsigned char * str);
+void yajl_free(yajl_handle handle);
+"""
+
+
+ffibuilder = FFI()
+ffibuilder.set_source('ijson.backends._yajl2_cffi', C_SOURCE,
+                      libraries=['yajl'])
+ffibuilder.cdef(CDEF)
+
+
+if __name__ == '__main__':
+    ffibuilder.compile(verbose=True)
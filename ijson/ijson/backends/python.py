@@ -2,16 +2,27 @@
 Pure-python parsing backend.
 '''
 from __future__ import unicode_literals
+from collections import deque
 import decimal
 import re
-from codecs import getreader
 
-from ijson import common
+from ijson import common, backends
 from ijson.compat import chr, bytetype
 
 
 BUFSIZE = 16 * 1024
-LEXEME_RE = re.compile(r'[a-z0-9eE\.\+-]+|\S')
+# lexemes are complete strings, literals or single symbols (also
+# non-ASCII ones); a string which continues in the next chunk is
+# matched as a single quote
+LEXEME_RE = re.compile(
+    br'"[^"\\]*(?:\\.[^"\\]*)*"|[a-z0-9eE\.\+-]+|[\xc0-\xff][\x80-\xbf]*|\S',
+    re.DOTALL)
+# the body of a string, up to its closing quote or the end of the buffer
+STRING_RE = re.compile(br'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+
+# punctuation decoded once, instead of on every occurrence
+PUNCTUATION = dict((lexeme, lexeme.decode('ascii'))
+                   for lexeme in [b'{', b'}', b'[', b']', b',', b':'])
 
 
 class UnexpectedSymbol(common.JSONError):
@@ -22,185 +33,394 @@ class UnexpectedSymbol(common.JSONError):
 
 
 def Lexer(f, buf_size=BUFSIZE):
-    if type(f.read(0)) == bytetype:
-        f = getreader('utf-8')(f)
-    buf = f.read(buf_size)
+    '''
+    Yields lexemes with their byte offsets. Scanning is done on bytes, and
+    only string lexemes are decoded from UTF-8. A lexeme spanning chunks is
+    collected in a bytearray, scanning each chunk once, so that long
+    strings take linear time.
+
+    When ``f.read`` returns None, as the source of a ``Parser`` does until
+    more data is fed, ``(None, None)`` is yielded and the read is retried
+    on the next iteration.
+    '''
+    read = f.read
+    if type(read(0)) != bytetype:
+        read = lambda size: f.read(size).encode('utf-8')
+    buf = read(buf_size)
+    while buf is None:
+        yield None, None
+        buf = read(buf_size)
     pos = 0
     discarded = 0
     while True:
         match = LEXEME_RE.search(buf, pos)
-        if match:
-            lexeme = match.group()
-            if lexeme == '"':
-                pos = match.start()
-                start = pos + 1
-                while True:
-                    try:
-                        end = buf.index('"', start)
-                        escpos = end - 1
-                        while buf[escpos] == '\\':
-                            escpos -= 1
-                        if (end - escpos) % 2 == 0:
-                            start = end + 1
-                        else:
-                            break
-                    except ValueError:
-                        data = f.read(buf_size)
-                        if not data:
-                            raise common.IncompleteJSONError('Incomplete string lexeme')
-                        buf += data
-                yield discarded + pos, buf[pos:end + 1]
-                pos = end + 1
-            else:
-                while match.end() == len(buf):
-                    data = f.read(buf_size)
-                    if not data:
-                        break
-                    buf += data
-                    match = LEXEME_RE.search(buf, pos)
-                    lexeme = match.group()
-                yield discarded + match.start(), lexeme
-                pos = match.end()
-        else:
-            data = f.read(buf_size)
+        if not match:
+            data = read(buf_size)
+            while data is None:
+                yield None, None
+                data = read(buf_size)
             if not data:
                 break
             discarded += len(buf)
             buf = data
             pos = 0
+            continue
+
+        lexeme = match.group()
+        start = match.start()
+        end = match.end()
+        symbol = PUNCTUATION.get(lexeme)
+        if symbol is None:
+            if lexeme == b'"':
+                # the string continues in the next chunk, which is
+                # matched from where the previous match stopped
+                pending = bytearray(buf[start:])
+                discarded += start
+                start = 0
+                end = STRING_RE.match(pending, 1).end()
+                while pending[end:end + 1] != b'"':
+                    data = read(buf_size)
+                    while data is None:
+                        yield None, None
+                        data = read(buf_size)
+                    if not data:
+                        raise common.IncompleteJSONError('Incomplete string lexeme')
+                    pending += data
+                    end = STRING_RE.match(pending, end).end()
+                end += 1
+                buf = bytes(pending)
+                lexeme = buf[:end]
+            elif end == len(buf) and lexeme[-1:] != b'"':
+                # only literals can continue in the next chunk, so
+                # punctuation is yielded without waiting for more input
+                pending = bytearray(buf[start:])
+                discarded += start
+                start = 0
+                end = len(pending)
+                while end == len(pending):
+                    data = read(buf_size)
+                    while data is None:
+                        yield None, None
+                        data = read(buf_size)
+                    if not data:
+                        break
+                    pending += data
+                    end = LEXEME_RE.match(pending).end()
+                buf = bytes(pending)
+                lexeme = buf[:end]
+            symbol = lexeme.decode('utf-8')
+        yield discarded + start, symbol
+        pos = end
 
 
 def unescape(s):
     start = 0
-    result = ''
+    result = []
     while start < len(s):
         pos = s.find('\\', start)
         if pos == -1:
             if start == 0:
                 return s
-            result += s[start:]
+            result.append(s[start:])
             break
-        result += s[start:pos]
+        result.append(s[start:pos])
         pos += 1
         esc = s[pos]
         if esc == 'u':
-            result += chr(int(s[pos + 1:pos + 5], 16))
+            result.append(chr(int(s[pos + 1:pos + 5], 16)))
             pos += 4
         elif esc == 'b':
-            result += '\b'
+            result.append('\b')
         elif esc == 'f':
-            result += '\f'
+            result.append('\f')
         elif esc == 'n':
-            result += '\n'
+            result.append('\n')
         elif esc == 'r':
-            result += '\r'
+            result.append('\r')
         elif esc == 't':
-            result += '\t'
+            result.append('\t')
         else:
-            result += esc
+            result.append(esc)
         start = pos + 1
-    return result
-
-
-def parse_value(lexer, symbol=None, pos=0):
-    try:
-        if symbol is None:
-            pos, symbol = next(lexer)
-        if symbol == 'null':
-            yield ('null', None)
-        elif symbol == 'true':
-            yield ('boolean', True)
-        elif symbol == 'false':
-            yield ('boolean', False)
-        elif symbol == '[':
-            for event in parse_array(lexer):
-                yield event
-        elif symbol == '{':
-            for event in parse_object(lexer):
-                yield event
-        elif symbol[0] == '"':
-            yield ('string', unescape(symbol[1:-1]))
-        else:
-            try:
-                yield ('number', common.number(symbol))
-            except decimal.InvalidOperation:
-                raise UnexpectedSymbol(symbol, pos)
-    except StopIteration:
-        raise common.IncompleteJSONError('Incomplete JSON data')
+    return ''.join(result)
 
 
-def parse_array(lexer):
-    yield ('start_array', None)
-    try:
-        pos, symbol = next(lexer)
-        if symbol != ']':
-            while True:
-                for event in parse_value(lexer, symbol, pos):
-                    yield event
-                pos, symbol = next(lexer)
-                if symbol == ']':
-                    break
-                if symbol != ',':
-                    raise UnexpectedSymbol(symbol, pos)
-                pos, symbol = next(lexer)
-        yield ('end_array', None)
-    except StopIteration:
-        raise common.IncompleteJSONError('Incomplete JSON data')
-
+def _basic_parse(lexer, use_float=False, offsets=False):
+    # yields events, or None when the lexer has no data yet. With offsets,
+    # container events have the offset of their opening bracket or the one
+    # after their closing bracket as values.
 
-def parse_object(lexer):
-    yield ('start_map', None)
+    # closing symbols of the open containers, so that nesting costs
+    # nothing per event, unlike a generator per level
+    containers = []
+    expect_key = False
     try:
         pos, symbol = next(lexer)
-        if symbol != '}':
-            while True:
+        while symbol is None:
+            yield None
+            pos, symbol = next(lexer)
+        while True:
+            if expect_key:
+                expect_key = False
                 if symbol[0] != '"':
                     raise UnexpectedSymbol(symbol, pos)
                 yield ('map_key', unescape(symbol[1:-1]))
                 pos, symbol = next(lexer)
+                while symbol is None:
+                    yield None
+                    pos, symbol = next(lexer)
                 if symbol != ':':
                     raise UnexpectedSymbol(symbol, pos)
-                for event in parse_value(lexer, None, pos):
-                    yield event
                 pos, symbol = next(lexer)
-                if symbol == '}':
-                    break
-                if symbol != ',':
+                while symbol is None:
+                    yield None
+                    pos, symbol = next(lexer)
+
+            if symbol[0] == '"':
+                yield ('string', unescape(symbol[1:-1]))
+            elif symbol == '{':
+                yield ('start_map', pos if offsets else None)
+                pos, symbol = next(lexer)
+                while symbol is None:
+                    yield None
+                    pos, symbol = next(lexer)
+                if symbol != '}':
+                    containers.append('}')
+                    expect_key = True
+                    continue
+                yield ('end_map', pos + 1 if offsets else None)
+            elif symbol == '[':
+                yield ('start_array', pos if offsets else None)
+                pos, symbol = next(lexer)
+                while symbol is None:
+                    yield None
+                    pos, symbol = next(lexer)
+                if symbol != ']':
+                    containers.append(']')
+                    continue
+                yield ('end_array', pos + 1 if offsets else None)
+            elif symbol == 'null':
+                yield ('null', None)
+            elif symbol == 'true':
+                yield ('boolean', True)
+            elif symbol == 'false':
+                yield ('boolean', False)
+            else:
+                try:
+                    number = common.number(symbol, use_float)
+                except (decimal.InvalidOperation, ValueError, OverflowError):
                     raise UnexpectedSymbol(symbol, pos)
+                yield ('number', number)
+
+            # a value is complete, close containers until the next one
+            while containers:
                 pos, symbol = next(lexer)
-        yield ('end_map', None)
+                while symbol is None:
+                    yield None
+                    pos, symbol = next(lexer)
+                if symbol == containers[-1]:
+                    containers.pop()
+                    if symbol == '}':
+                        yield ('end_map', pos + 1 if offsets else None)
+                    else:
+                        yield ('end_array', pos + 1 if offsets else None)
+                elif symbol == ',':
+                    expect_key = containers[-1] == '}'
+                    pos, symbol = next(lexer)
+                    while symbol is None:
+                        yield None
+                        pos, symbol = next(lexer)
+                    break
+                else:
+                    raise UnexpectedSymbol(symbol, pos)
+            else:
+                break
     except StopIteration:
         raise common.IncompleteJSONError('Incomplete JSON data')
 
+    for pos, symbol in lexer:
+        if symbol is not None:
+            raise common.JSONError('Additional data')
+        yield None
+
 
-def basic_parse(file, buf_size=BUFSIZE):
+class _Chunks(object):
+    '''
+    The source of a ``Parser``, returning the chunks fed so far, and None
+    when there are none left until the parser is closed.
+    '''
+    def __init__(self):
+        self.chunks = deque()
+        self.closed = False
+
+    def read(self, size):
+        if self.chunks and size:
+            return self.chunks.popleft()
+        if self.closed or not size:
+            return b''
+        return None
+
+
+class _Buffer(object):
+    '''
+    A source returning a whole bytes-like object in its first read, which
+    the lexer then scans in place.
+    '''
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def read(self, size):
+        if not size:
+            return b''
+        buffer, self.buffer = self.buffer, b''
+        return buffer
+
+
+class Parser(object):
+    '''
+    Push parser, for input which arrives in chunks rather than being read
+    from a file. ``feed`` takes a chunk of bytes and returns a list of the
+    events which could be parsed so far, ``close`` ends the input and
+    returns the remaining events::
+
+        parser = Parser()
+        for data in chunks:
+            for event, value in parser.feed(data):
+                # ...
+        for event, value in parser.close():
+            # ...
+
+    Errors are raised from ``feed`` and ``close``.
+
+    Parameters:
+
+    - use_float: yields non-integer numbers as floats instead of Decimals
+    - offsets: yields the byte offsets of the opening brackets of maps and
+      arrays as the values of their start events, and the offsets after
+      their closing brackets as the values of their end events
+    '''
+    def __init__(self, use_float=False, offsets=False):
+        self.source = _Chunks()
+        self.parser = _basic_parse(Lexer(self.source), use_float, offsets)
+
+    def feed(self, data):
+        if not isinstance(data, bytetype):
+            data = data.encode('utf-8')
+        if data:
+            self.source.chunks.append(data)
+        return self._events()
+
+    def close(self):
+        self.source.closed = True
+        return self._events()
+
+    def _events(self):
+        events = []
+        for event in self.parser:
+            if event is None:
+                break
+            events.append(event)
+        return events
+
+
+def basic_parse(file, buf_size=BUFSIZE, use_float=False, offsets=False):
     '''
     Iterator yielding unprefixed events.
 
     Parameters:
 
     - file: a readable file-like object with JSON input
+    - use_float: yields non-integer numbers as floats instead of Decimals
+    - offsets: yields the byte offsets of maps and arrays, see ``Parser``
+
+    Events are parsed like in ``Parser``, with chunks read from the file
+    as they are needed rather than fed.
     '''
-    lexer = iter(Lexer(file, buf_size))
-    for value in parse_value(lexer):
-        yield value
-    try:
-        next(lexer)
-    except StopIteration:
-        pass
-    else:
-        raise common.JSONError('Additional data')
+    return _basic_parse(Lexer(file, buf_size), use_float, offsets)
+
 
+def basic_parse_buffer(buffer, use_float=False, offsets=False):
+    '''
+    Iterator yielding unprefixed events of a document already in memory, in
+    bytes, a bytearray, a memoryview or an mmap. The lexer scans the buffer
+    itself, and only the lexemes are copied out of it.
+
+    Parameters:
 
-def parse(file, buf_size=BUFSIZE):
+    - buffer: a bytes-like object with JSON input
+    - use_float: yields non-integer numbers as floats instead of Decimals
+    - offsets: yields the byte offsets of maps and arrays, see ``Parser``
+    '''
+    return _basic_parse(Lexer(_Buffer(buffer)), use_float, offsets)
+
+
+def parse(file, buf_size=BUFSIZE, tuple_paths=False, use_float=False,
+          selector=None):
     '''
     Backend-specific wrapper for ijson.common.parse.
     '''
-    return common.parse(basic_parse(file, buf_size=buf_size))
+    return common.parse(basic_parse(file, buf_size=buf_size, use_float=use_float),
+                        tuple_paths, selector)
+
+
+def parse_buffer(buffer, tuple_paths=False, use_float=False, selector=None):
+    '''
+    Backend-specific wrapper for ijson.common.parse with basic_parse_buffer.
+    '''
+    return common.parse(basic_parse_buffer(buffer, use_float=use_float),
+                        tuple_paths, selector)
+
+
+def parse_file_mmap(path, tuple_paths=False, use_float=False, selector=None):
+    '''
+    Like parse_buffer for the file at a path, which is mapped into memory
+    rather than read, so that files larger than the memory can be parsed.
+    '''
+    events = backends.mmap_events(basic_parse_buffer, path, use_float=use_float)
+    return common.parse(events, tuple_paths, selector)
+
+
+def items(file, prefix, fast_subtrees=False, **kwargs):
+    '''
+    Backend-specific wrapper for ijson.common.items, or
+    ijson.common.select_items for a Selector. A tuple prefix selects tuple
+    paths. With ``fast_subtrees``, maps and arrays under a prefix are
+    decoded by ijson.common.fast_items.
+    '''
+    if isinstance(prefix, common.Selector):
+        return common.select_items(basic_parse(file, **kwargs), prefix)
+    if fast_subtrees:
+        recorder = common.Recorder(file)
+        events = basic_parse(recorder, offsets=True, **kwargs)
+        return common.fast_items(events, prefix, recorder, kwargs.get('use_float', False))
+    return common.items(parse(file, tuple_paths=isinstance(prefix, tuple), **kwargs),
+                        prefix)
+
+
+def kvitems(file, prefix, **kwargs):
+    '''
+    Backend-specific wrapper for ijson.common.kvitems. A tuple prefix
+    selects tuple paths.
+    '''
+    return common.kvitems(parse(file, tuple_paths=isinstance(prefix, tuple), **kwargs),
+                          prefix)
+
+
+def items_multi(file, prefixes, **kwargs):
+    '''
+    Backend-specific wrapper for ijson.common.items_multi. Tuple prefixes
+    select tuple paths.
+    '''
+    prefixes = list(prefixes)
+    tuple_paths = any(isinstance(prefix, tuple) for prefix in prefixes)
+    return common.items_multi(parse(file, tuple_paths=tuple_paths, **kwargs),
+                              prefixes)
 
 
-def items(file, prefix):
+def columns(file, prefix, fields=None, types='d', use_numpy=False, **kwargs):
     '''
-    Backend-specific wrapper for ijson.common.items.
+    Backend-specific wrapper for ijson.common.columns. A tuple prefix
+    selects tuple paths.
     '''
-    return common.items(parse(file), prefix)
+    return common.columns(parse(file, tuple_paths=isinstance(prefix, tuple), **kwargs),
+                          prefix, fields, types, use_numpy)
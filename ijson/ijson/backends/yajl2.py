@@ -3,7 +3,7 @@ Wrapper for YAJL C library version 2.x.
 '''
 
 from ctypes import Structure, c_uint, c_ubyte, c_int, c_long, c_double, c_char, \
-                   c_void_p, c_char_p, CFUNCTYPE, POINTER, byref, string_at, cast
+                   c_void_p, c_char_p, c_size_t, CFUNCTYPE, POINTER, byref, string_at, cast
 
 from ijson import common, backends
 from ijson.compat import b2s
@@ -13,6 +13,7 @@ yajl = backends.find_yajl_ctypes(2)
 
 yajl.yajl_alloc.restype = POINTER(c_char)
 yajl.yajl_get_error.restype = POINTER(c_char)
+yajl.yajl_get_bytes_consumed.restype = c_size_t
 
 C_EMPTY = CFUNCTYPE(c_int, c_void_p)
 C_INT = CFUNCTYPE(c_int, c_void_p, c_int)
@@ -43,6 +44,9 @@ _callback_data = [
 class Callbacks(Structure):
     _fields_ = [(name, type) for name, type, func in _callback_data]
 
+# default size of the chunks read from files
+BUFSIZE = 64 * 1024
+
 YAJL_OK = 0
 YAJL_CANCELLED = 1
 YAJL_INSUFFICIENT_DATA = 2
@@ -53,8 +57,98 @@ YAJL_ALLOW_COMMENTS = 1
 YAJL_MULTIPLE_VALUES = 8
 
 
-def basic_parse(f, allow_comments=False, buf_size=64 * 1024,
-                multiple_values=False):
+class Parser(object):
+    '''
+    Push parser, for input which arrives in chunks rather than being read
+    from a file. ``feed`` takes a chunk of bytes and returns a list of the
+    events which could be parsed so far, ``close`` ends the input and
+    returns the remaining events. Errors are raised from ``feed`` and
+    ``close``.
+
+    Parameters:
+
+    - allow_comments: tells parser to allow comments in JSON input
+    - multiple_values: allows the parser to parse multiple JSON objects
+    - use_float: yields non-integer numbers as floats instead of Decimals
+    - offsets: yields the byte offsets of the opening brackets of maps and
+      arrays as the values of their start events, and the offsets after
+      their closing brackets as the values of their end events
+    '''
+    def __init__(self, allow_comments=False, multiple_values=False,
+                 use_float=False, offsets=False):
+        events = self.events = []
+        # the handle and the number of bytes parsed before the current chunk
+        position = self.position = [None, 0]
+
+        def callback(event, func_type, func):
+            def c_callback(context, *args):
+                events.append((event, func(*args)))
+                return 1
+            return func_type(c_callback)
+
+        def offset_callback(event, func_type, func):
+            # the bytes consumed from the chunk end with the bracket
+            shift = 1 if event.startswith('start') else 0
+            def c_callback(context):
+                consumed = yajl.yajl_get_bytes_consumed(position[0])
+                events.append((event, position[1] + consumed - shift))
+                return 1
+            return func_type(c_callback)
+
+        number = lambda v, l: common.number(b2s(string_at(v, l)), use_float)
+        self.callbacks = Callbacks(*[
+            (offset_callback if offsets and event in common.CONTAINER_EVENTS else callback)
+            (event, func_type, number if event == 'number' else func)
+            for event, func_type, func in _callback_data])
+        self.handle = position[0] = yajl.yajl_alloc(byref(self.callbacks), None, None)
+        if allow_comments:
+            yajl.yajl_config(self.handle, YAJL_ALLOW_COMMENTS, 1)
+        if multiple_values:
+            yajl.yajl_config(self.handle, YAJL_MULTIPLE_VALUES, 1)
+
+    def feed(self, data):
+        if data:
+            self._parse(data)
+        return self._events()
+
+    def close(self):
+        try:
+            self._parse(b'')
+            return self._events()
+        finally:
+            self._free()
+
+    def _parse(self, buffer):
+        if self.handle is None:
+            raise common.JSONError('Parser is closed')
+        if buffer:
+            result = yajl.yajl_parse(self.handle, buffer, len(buffer))
+            self.position[1] += len(buffer)
+        else:
+            result = yajl.yajl_complete_parse(self.handle)
+        if result != YAJL_OK:
+            perror = yajl.yajl_get_error(self.handle, 1, buffer, len(buffer))
+            error = cast(perror, c_char_p).value
+            yajl.yajl_free_error(self.handle, perror)
+            exception = common.IncompleteJSONError if result == YAJL_INSUFFICIENT_DATA else common.JSONError
+            raise exception(error.decode('utf-8'))
+
+    def _events(self):
+        events = self.events[:]
+        del self.events[:]
+        return events
+
+    def _free(self):
+        if self.handle is not None:
+            yajl.yajl_free(self.handle)
+            self.handle = None
+
+    def __del__(self):
+        self._free()
+
+
+def basic_parse(f, allow_comments=False, buf_size=BUFSIZE,
+                multiple_values=False, use_float=False, offsets=False):
     '''
     Iterator yielding unprefixed events.
 
@@ -64,51 +158,96 @@ def basic_parse(f, allow_comments=False, buf_size=64 * 1024,
     - allow_comments: tells parser to allow comments in JSON input
     - buf_size: a size of an input buffer
     - multiple_values: allows the parser to parse multiple JSON objects
+    - use_float: yields non-integer numbers as floats instead of Decimals
+    - offsets: yields the byte offsets of maps and arrays, see ``Parser``
+    '''
+    parser = Parser(allow_comments, multiple_values, use_float, offsets)
+    while True:
+        buffer = f.read(buf_size)
+        events = parser.feed(buffer) if buffer else parser.close()
+        for event in events:
+            yield event
+        if not buffer:
+            break
+
+def basic_parse_buffer(buffer, allow_comments=False, buf_size=BUFSIZE,
+                       multiple_values=False, use_float=False, offsets=False):
+    '''
+    Iterator yielding unprefixed events of a document already in memory, in
+    bytes, a bytearray, a memoryview or an mmap. Chunks of the buffer are
+    passed to yajl in place rather than copied.
+
+    Parameters:
+
+    - buffer: a bytes-like object with JSON input
+    - allow_comments: tells parser to allow comments in JSON input
+    - buf_size: a size of the chunks passed to yajl
+    - multiple_values: allows the parser to parse multiple JSON objects
+    - use_float: yields non-integer numbers as floats instead of Decimals
+    - offsets: yields the byte offsets of maps and arrays, see ``Parser``
     '''
-    events = []
-
-    def callback(event, func_type, func):
-        def c_callback(context, *args):
-            events.append((event, func(*args)))
-            return 1
-        return func_type(c_callback)
-
-    callbacks = Callbacks(*[callback(*data) for data in _callback_data])
-    handle = yajl.yajl_alloc(byref(callbacks), None, None)
-    if allow_comments:
-        yajl.yajl_config(handle, YAJL_ALLOW_COMMENTS, 1)
-    if multiple_values:
-        yajl.yajl_config(handle, YAJL_MULTIPLE_VALUES, 1)
-    try:
-        while True:
-            buffer = f.read(buf_size)
-            if buffer:
-                result = yajl.yajl_parse(handle, buffer, len(buffer))
-            else:
-                result = yajl.yajl_complete_parse(handle)
-            if result != YAJL_OK:
-                perror = yajl.yajl_get_error(handle, 1, buffer, len(buffer))
-                error = cast(perror, c_char_p).value
-                yajl.yajl_free_error(handle, perror)
-                exception = common.IncompleteJSONError if result == YAJL_INSUFFICIENT_DATA else common.JSONError
-                raise exception(error.decode('utf-8'))
-            if not buffer and not events:
-                break
-
-            for event in events:
-                yield event
-            events = []
-    finally:
-        yajl.yajl_free(handle)
-
-def parse(file, **kwargs):
+    parser = Parser(allow_comments, multiple_values, use_float, offsets)
+    for chunk in backends.ctypes_chunks(buffer, buf_size):
+        for event in parser.feed(chunk):
+            yield event
+    for event in parser.close():
+        yield event
+
+def parse(file, tuple_paths=False, selector=None, **kwargs):
     '''
     Backend-specific wrapper for ijson.common.parse.
     '''
-    return common.parse(basic_parse(file, **kwargs))
+    return common.parse(basic_parse(file, **kwargs), tuple_paths, selector)
+
+def parse_buffer(buffer, tuple_paths=False, selector=None, **kwargs):
+    '''
+    Backend-specific wrapper for ijson.common.parse with basic_parse_buffer.
+    '''
+    return common.parse(basic_parse_buffer(buffer, **kwargs), tuple_paths, selector)
+
+def parse_file_mmap(path, tuple_paths=False, selector=None, **kwargs):
+    '''
+    Like parse_buffer for the file at a path, which is mapped into memory
+    rather than read, so that files larger than the memory can be parsed.
+    '''
+    events = backends.mmap_events(basic_parse_buffer, path, **kwargs)
+    return common.parse(events, tuple_paths, selector)
+
+def items(file, prefix, fast_subtrees=False, **kwargs):
+    '''
+    Backend-specific wrapper for ijson.common.items, or
+    ijson.common.select_items for a Selector. A tuple prefix selects tuple
+    paths. With ``fast_subtrees``, maps and arrays under a prefix are
+    decoded by ijson.common.fast_items.
+    '''
+    if isinstance(prefix, common.Selector):
+        return common.select_items(basic_parse(file, **kwargs), prefix)
+    if fast_subtrees:
+        recorder = common.Recorder(file)
+        events = basic_parse(recorder, offsets=True, **kwargs)
+        return common.fast_items(events, prefix, recorder, kwargs.get('use_float', False))
+    return common.items(parse(file, isinstance(prefix, tuple), **kwargs), prefix)
+
+def kvitems(file, prefix, **kwargs):
+    '''
+    Backend-specific wrapper for ijson.common.kvitems. A tuple prefix
+    selects tuple paths.
+    '''
+    return common.kvitems(parse(file, isinstance(prefix, tuple), **kwargs), prefix)
+
+def items_multi(file, prefixes, **kwargs):
+    '''
+    Backend-specific wrapper for ijson.common.items_multi. Tuple prefixes
+    select tuple paths.
+    '''
+    prefixes = list(prefixes)
+    tuple_paths = any(isinstance(prefix, tuple) for prefix in prefixes)
+    return common.items_multi(parse(file, tuple_paths, **kwargs), prefixes)
 
-def items(file, prefix):
+def columns(file, prefix, fields=None, types='d', use_numpy=False, **kwargs):
     '''
-    Backend-specific wrapper for ijson.common.items.
+    Backend-specific wrapper for ijson.common.columns. A tuple prefix
+    selects tuple paths.
     '''
-    return common.items(parse(file), prefix)
+    return common.columns(parse(file, isinstance(prefix, tuple), **kwargs),
+                          prefix, fields, types, use_numpy)
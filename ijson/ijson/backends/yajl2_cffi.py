@@ -2,6 +2,7 @@
 CFFI-Wrapper for YAJL C library version 2.x.
 '''
 
+from array import array
 from cffi import FFI
 import functools
 import sys
@@ -9,6 +10,14 @@ import sys
 from ijson import common, backends
 from ijson.compat import b2s
 
+# compiled helper built by _yajl2_cffi_build, which records events in C
+try:
+    from ijson.backends._yajl2_cffi import ffi as batch_ffi, lib as batch_lib
+    if getattr(batch_lib, 'IJSON_BATCH_VERSION', 1) < 2:
+        raise ImportError('Helper built from an older version of ijson')
+except ImportError:
+    batch_ffi = batch_lib = None
+
 
 ffi = FFI()
 ffi.cdef("""
@@ -59,11 +68,15 @@ yajl_status yajl_complete_parse(yajl_handle hand);
 unsigned char* yajl_get_error(yajl_handle hand, int verbose, const unsigned char *jsonText, size_t jsonTextLength);
 void yajl_free_error(yajl_handle hand, unsigned char * str);
 void yajl_free(yajl_handle handle);
+size_t yajl_get_bytes_consumed(yajl_handle hand);
 """)
 
 
 yajl = backends.find_yajl_cffi(ffi, 2)
 
+# default size of the chunks read from files
+BUFSIZE = 64 * 1024
+
 YAJL_OK = 0
 YAJL_CANCELLED = 1
 YAJL_INSUFFICIENT_DATA = 2
@@ -116,6 +129,12 @@ def number(val, length):
     return common.number(b2s(ffi.string(val, maxlen=length)))
 
 
+@ffi.callback('int(void *ctx, const char *numberVal, size_t numberLen)')
+@append_event_to_ctx('number')
+def float_number(val, length):
+    return common.number(b2s(ffi.string(val, maxlen=length)), use_float=True)
+
+
 @ffi.callback('int(void *ctx, const unsigned char *stringVal, size_t stringLen)')
 @append_event_to_ctx('string')
 def string(val, length):
@@ -160,16 +179,57 @@ _callback_data = (
 )
 
 
+# callbacks with float numbers
+_float_callback_data = tuple(float_number if callback is number else callback
+                             for callback in _callback_data)
+
+
+class Events(list):
+    '''
+    The events of a CallbackParser, with its handle and the number of bytes
+    parsed before the current chunk for the offsets of containers.
+    '''
+    handle = None
+    parsed = 0
+
+
+def append_offset_to_ctx(event):
+    # the bytes consumed from the chunk end with the bracket
+    shift = 1 if event.startswith('start') else 0
+    @ffi.callback('int(void *ctx)')
+    def callback(ctx):
+        events = ffi.from_handle(ctx)
+        consumed = yajl.yajl_get_bytes_consumed(events.handle)
+        events.append((event, events.parsed + consumed - shift))
+        return 1
+    return callback
+
+
+# callbacks of containers with their offsets as values
+_offset_callbacks = {
+    start_map: append_offset_to_ctx('start_map'),
+    end_map: append_offset_to_ctx('end_map'),
+    start_array: append_offset_to_ctx('start_array'),
+    end_array: append_offset_to_ctx('end_array'),
+}
+
+
 _asd = list()
-def yajl_init(scope, events, allow_comments=False, multiple_values=False):
+def yajl_init(scope, events, allow_comments=False, multiple_values=False,
+              use_float=False, offsets=False):
+    callbacks = _float_callback_data if use_float else _callback_data
+    if offsets:
+        callbacks = tuple(_offset_callbacks.get(callback, callback)
+                          for callback in callbacks)
     scope.ctx = ffi.new_handle(events)
-    scope.callbacks = ffi.new('yajl_callbacks*', _callback_data)
+    scope.callbacks = ffi.new('yajl_callbacks*', callbacks)
     handle = yajl.yajl_alloc(scope.callbacks, ffi.NULL, scope.ctx)
+    events.handle = handle
 
     if allow_comments:
-        yajl.yajl_config(handle, YAJL_ALLOW_COMMENTS, 1)
+        yajl.yajl_config(handle, YAJL_ALLOW_COMMENTS, ffi.cast('int', 1))
     if multiple_values:
-        yajl.yajl_config(handle, YAJL_MULTIPLE_VALUES, 1)
+        yajl.yajl_config(handle, YAJL_MULTIPLE_VALUES, ffi.cast('int', 1))
 
     return handle
 
@@ -192,52 +252,288 @@ class Container(object):
     pass
 
 
-def basic_parse(f, buf_size=64*1024, **config):
+class CallbackParser(object):
+    '''
+    Push parser calling back into Python for every event, see Parser.
+    '''
+    def __init__(self, allow_comments=False, multiple_values=False,
+                 use_float=False, offsets=False):
+        # the scope objects makes sure the C objects allocated in _yajl.init
+        # are kept alive as long as the parser
+        self.scope = Container()
+        self.events = Events()
+        self.handle = yajl_init(self.scope, self.events, allow_comments,
+                                multiple_values, use_float, offsets)
+
+    def feed(self, data):
+        if data:
+            self._parse(data)
+        return self._events()
+
+    def close(self):
+        try:
+            self._parse(b'')
+            return self._events()
+        finally:
+            self._free()
+
+    def _parse(self, data):
+        if self.handle is None:
+            raise common.JSONError('Parser is closed')
+        # this calls the callbacks which will
+        # fill the events list
+        yajl_parse(self.handle, data)
+        self.events.parsed += len(data)
+
+    def _events(self):
+        events = self.events[:]
+        # clear all events, but don't replace the
+        # the events list instance
+        del self.events[:]
+        return events
+
+    def _free(self):
+        if self.handle is not None:
+            yajl.yajl_free(self.handle)
+            self.handle = None
+
+    def __del__(self):
+        self._free()
+
+
+# event names by the type of records in a batch
+BATCH_EVENTS = (
+    'null', 'boolean', 'number', 'string', 'start_map',
+    'map_key', 'end_map', 'start_array', 'end_array'
+)
+
+
+def batch_events(batch, use_float=False, chunk_offset=None):
+    '''
+    Decodes the events recorded in a batch by the compiled helper. With the
+    offset of the chunk they were parsed from, the values of containers are
+    their offsets.
+    '''
+    records = array('I')
+    data = batch_ffi.buffer(batch.events, batch.count * batch_ffi.sizeof('ijson_event'))
+    if hasattr(records, 'frombytes'):
+        records.frombytes(data[:])
+    else:
+        records.fromstring(data[:])
+    data = batch_ffi.buffer(batch.data, batch.data_length)[:] if batch.data_length else b''
+
+    events = []
+    append = events.append
+    number = common.number
+    records = iter(records)
+    for kind, offset, length in zip(records, records, records):
+        if kind == 3:
+            value = data[offset:offset + length].decode('utf-8')
+        elif kind == 2:
+            value = number(b2s(data[offset:offset + length]), use_float)
+        elif kind == 5:
+            value = b2s(data[offset:offset + length])
+        elif kind == 1:
+            value = bool(length)
+        elif kind and chunk_offset is not None:
+            value = chunk_offset + length - (kind == 4 or kind == 7)
+        else:
+            value = None
+        append((BATCH_EVENTS[kind], value))
+    return events
+
+
+class BatchParser(object):
+    '''
+    Push parser with events recorded in C, and decoded once per chunk, see
+    Parser.
+    '''
+    def __init__(self, allow_comments=False, multiple_values=False,
+                 use_float=False, offsets=False):
+        self.use_float = use_float
+        self.offsets = offsets
+        # offsets of the chunk being parsed and of the next one
+        self.offset = self.parsed = 0
+        self.batch = batch_ffi.new('ijson_batch *')
+        self.handle = batch_lib.ijson_alloc(self.batch, allow_comments,
+                                            multiple_values)
+        if self.handle == batch_ffi.NULL:
+            self.handle = None
+            raise MemoryError()
+
+    def feed(self, data):
+        if data:
+            self._parse(data)
+        return self._events()
+
+    def close(self):
+        try:
+            self._parse(b'')
+            return self._events()
+        finally:
+            self._free()
+
+    def _parse(self, data):
+        if self.handle is None:
+            raise common.JSONError('Parser is closed')
+        if data:
+            result = batch_lib.yajl_parse(self.handle, data, len(data))
+            self.offset = self.parsed
+            self.parsed += len(data)
+        else:
+            result = batch_lib.yajl_complete_parse(self.handle)
+
+        if result != YAJL_OK:
+            if self.batch.failed:
+                raise MemoryError()
+            perror = batch_lib.yajl_get_error(self.handle, 1, data, len(data))
+            error = batch_ffi.string(perror)
+            batch_lib.yajl_free_error(self.handle, perror)
+            exception = common.IncompleteJSONError if result == YAJL_INSUFFICIENT_DATA else common.JSONError
+            raise exception(error)
+
+    def _events(self):
+        if not self.batch.count:
+            return []
+        events = batch_events(self.batch, self.use_float,
+                              self.offset if self.offsets else None)
+        batch_lib.ijson_reset(self.batch)
+        return events
+
+    def _free(self):
+        if self.handle is not None:
+            batch_lib.yajl_free(self.handle)
+            batch_lib.ijson_free(self.batch)
+            self.handle = None
+
+    def __del__(self):
+        self._free()
+
+
+class Parser(BatchParser if batch_lib is not None else CallbackParser):
+    '''
+    Push parser, for input which arrives in chunks rather than being read
+    from a file. ``feed`` takes a chunk of bytes and returns a list of the
+    events which could be parsed so far, ``close`` ends the input and
+    returns the remaining events. Errors are raised from ``feed`` and
+    ``close``.
+
+    Parameters:
+
+    - allow_comments: tells parser to allow comments in JSON input
+    - multiple_values: allows the parser to parse multiple JSON objects
+    - use_float: yields non-integer numbers as floats instead of Decimals
+    - offsets: yields the byte offsets of the opening brackets of maps and
+      arrays as the values of their start events, and the offsets after
+      their closing brackets as the values of their end events
+    '''
+
+
+def basic_parse(f, buf_size=BUFSIZE, allow_comments=False,
+                multiple_values=False, use_float=False, offsets=False):
     '''
     Iterator yielding unprefixed events.
 
     Parameters:
 
     - f: a readable file-like object with JSON input
-    - allow_comments: tells parser to allow comments in JSON input
     - buf_size: a size of an input buffer
+    - allow_comments: tells parser to allow comments in JSON input
     - multiple_values: allows the parser to parse multiple JSON objects
+    - use_float: yields non-integer numbers as floats instead of Decimals
+    - offsets: yields the byte offsets of maps and arrays, see ``Parser``
     '''
+    parser = Parser(allow_comments, multiple_values, use_float, offsets)
+    while True:
+        buffer = f.read(buf_size)
+        events = parser.feed(buffer) if buffer else parser.close()
+        for event in events:
+            yield event
+        if not buffer:
+            break
+
+
+def basic_parse_buffer(buffer, buf_size=BUFSIZE, allow_comments=False,
+                       multiple_values=False, use_float=False, offsets=False):
+    '''
+    Iterator yielding unprefixed events of a document already in memory, in
+    bytes, a bytearray, a memoryview or an mmap. Chunks of the buffer are
+    passed to yajl in place rather than copied.
 
-    # the scope objects makes sure the C objects allocated in _yajl.init
-    # are kept alive until this function is done
-    scope = Container()
-    events = []
+    Parameters:
 
-    handle = yajl_init(scope, events, **config)
-    try:
-        while True:
-            buffer = f.read(buf_size)
-            # this calls the callbacks which will
-            # fill the events list
-            yajl_parse(handle, buffer)
+    - buffer: a bytes-like object with JSON input
+    - buf_size: a size of the chunks passed to yajl
+    - allow_comments: tells parser to allow comments in JSON input
+    - multiple_values: allows the parser to parse multiple JSON objects
+    - use_float: yields non-integer numbers as floats instead of Decimals
+    - offsets: yields the byte offsets of maps and arrays, see ``Parser``
+    '''
+    parser = Parser(allow_comments, multiple_values, use_float, offsets)
+    data = ffi.from_buffer(buffer)
+    length = len(data)
+    for start in range(0, length, buf_size):
+        for event in parser.feed(data[start:min(start + buf_size, length)]):
+            yield event
+    for event in parser.close():
+        yield event
 
-            if not buffer and not events:
-                break
 
-            for event in events:
-                yield event
+def parse(file, tuple_paths=False, selector=None, **kwargs):
+    '''
+    Backend-specific wrapper for ijson.common.parse.
+    '''
+    return common.parse(basic_parse(file, **kwargs), tuple_paths, selector)
+
+def parse_buffer(buffer, tuple_paths=False, selector=None, **kwargs):
+    '''
+    Backend-specific wrapper for ijson.common.parse with basic_parse_buffer.
+    '''
+    return common.parse(basic_parse_buffer(buffer, **kwargs), tuple_paths, selector)
 
-            # clear all events, but don't replace the
-            # the events list instance
-            del events[:]
-    finally:
-        yajl.yajl_free(handle)
+def parse_file_mmap(path, tuple_paths=False, selector=None, **kwargs):
+    '''
+    Like parse_buffer for the file at a path, which is mapped into memory
+    rather than read, so that files larger than the memory can be parsed.
+    '''
+    events = backends.mmap_events(basic_parse_buffer, path, **kwargs)
+    return common.parse(events, tuple_paths, selector)
 
+def items(file, prefix, fast_subtrees=False, **kwargs):
+    '''
+    Backend-specific wrapper for ijson.common.items, or
+    ijson.common.select_items for a Selector. A tuple prefix selects tuple
+    paths. With ``fast_subtrees``, maps and arrays under a prefix are
+    decoded by ijson.common.fast_items.
+    '''
+    if isinstance(prefix, common.Selector):
+        return common.select_items(basic_parse(file, **kwargs), prefix)
+    if fast_subtrees:
+        recorder = common.Recorder(file)
+        events = basic_parse(recorder, offsets=True, **kwargs)
+        return common.fast_items(events, prefix, recorder, kwargs.get('use_float', False))
+    return common.items(parse(file, isinstance(prefix, tuple), **kwargs), prefix)
+
+def kvitems(file, prefix, **kwargs):
+    '''
+    Backend-specific wrapper for ijson.common.kvitems. A tuple prefix
+    selects tuple paths.
+    '''
+    return common.kvitems(parse(file, isinstance(prefix, tuple), **kwargs), prefix)
 
-def parse(file, **kwargs):
+def items_multi(file, prefixes, **kwargs):
     '''
-    Backend-specific wrapper for ijson.common.parse.
+    Backend-specific wrapper for ijson.common.items_multi. Tuple prefixes
+    select tuple paths.
     '''
-    return common.parse(basic_parse(file, **kwargs))
+    prefixes = list(prefixes)
+    tuple_paths = any(isinstance(prefix, tuple) for prefix in prefixes)
+    return common.items_multi(parse(file, tuple_paths, **kwargs), prefixes)
 
-def items(file, prefix):
+def columns(file, prefix, fields=None, types='d', use_numpy=False, **kwargs):
     '''
-    Backend-specific wrapper for ijson.common.items.
+    Backend-specific wrapper for ijson.common.columns. A tuple prefix
+    selects tuple paths.
     '''
-    return common.items(parse(file), prefix)
+    return common.columns(parse(file, isinstance(prefix, tuple), **kwargs),
+                          prefix, fields, types, use_numpy)
@@ -0,0 +1,221 @@
+'''
+Benchmarks for ijson backends on generated documents.
+
+Usage::
+
+    python -m ijson.benchmark [-b BACKEND ...] [-m METHOD ...] [-d DOCUMENT ...]
+                              [--ref REVISION]
+
+Each method is run on each document with each backend which can be
+imported, and the best time of several runs is reported. With ``--ref``,
+the backends are also run as they were at a git revision, to compare a
+change with the code it replaces, e.g. ``--ref HEAD~1``.
+'''
+from __future__ import print_function
+
+import argparse
+import io
+import json
+import os
+import subprocess
+import time
+import types
+
+from ijson import common
+
+
+def deep(depth=150, count=100):
+    '''
+    Nested arrays and maps, many levels deep.
+    '''
+    doc = 'leaf'
+    for i in range(depth):
+        doc = {'key%d' % i: [doc, i]} if i % 2 else [doc, {'n': i}]
+    return [doc] * count
+
+
+def wide(count=20000):
+    '''
+    A long array of flat records.
+    '''
+    return [{'id': i, 'name': 'name %d' % i, 'flag': i % 2 == 0,
+             'parent': None, 'tags': ['a', 'b']} for i in range(count)]
+
+
+def long_strings(count=20, length=200000):
+    '''
+    Records with long string values, like SourceKitten documentation.
+    '''
+    text = 'Returns a \\"value\\",\n' * (length // 24)
+    return [{'name': 'doc %d' % i, 'docBrief': text} for i in range(count)]
+
+
+def numbers(count=100000):
+    '''
+    Integers and floats, like offsets and lengths in SourceKitten output.
+    '''
+    return [[i, i * 1000003, i / 7.0] for i in range(count)]
+
+
+DOCUMENTS = {
+    'deep': deep,
+    'wide': wide,
+    'long_strings': long_strings,
+    'numbers': numbers,
+}
+
+
+def run_basic_parse(backend, data):
+    for event in backend.basic_parse(io.BytesIO(data)):
+        pass
+
+
+def run_parse(backend, data):
+    for event in backend.parse(io.BytesIO(data)):
+        pass
+
+
+def run_parse_tuples(backend, data):
+    for event in backend.parse(io.BytesIO(data), tuple_paths=True):
+        pass
+
+
+def run_basic_parse_float(backend, data):
+    for event in backend.basic_parse(io.BytesIO(data), use_float=True):
+        pass
+
+
+def run_items(backend, data):
+    for item in backend.items(io.BytesIO(data), 'item'):
+        pass
+
+
+def run_basic_parse_buffer(backend, data):
+    for event in backend.basic_parse_buffer(data):
+        pass
+
+
+def run_items_fast(backend, data):
+    for item in backend.items(io.BytesIO(data), 'item', fast_subtrees=True):
+        pass
+
+
+def run_push(backend, data, chunk_size=64 * 1024):
+    parser = backend.Parser()
+    for start in range(0, len(data), chunk_size):
+        for event in parser.feed(data[start:start + chunk_size]):
+            pass
+    for event in parser.close():
+        pass
+
+
+def run_common_parse(backend, data):
+    '''
+    Only ``common.parse`` on events recorded beforehand.
+    '''
+    events = list(backend.basic_parse(io.BytesIO(data)))
+    start = time.time()
+    for event in common.parse(events):
+        pass
+    return time.time() - start
+
+
+METHODS = {
+    'basic_parse': run_basic_parse,
+    'basic_parse_float': run_basic_parse_float,
+    'basic_parse_buffer': run_basic_parse_buffer,
+    'parse': run_parse,
+    'parse_tuples': run_parse_tuples,
+    'items': run_items,
+    'items_fast': run_items_fast,
+    'push': run_push,
+    'common_parse': run_common_parse,
+}
+
+BACKENDS = ['python', 'yajl2_cffi', 'yajl2', 'yajl']
+
+
+def import_backend(name):
+    '''
+    Imports a backend by name, returns None if it is not available.
+    '''
+    try:
+        return __import__('ijson.backends.' + name, fromlist=[name])
+    except ImportError:
+        return None
+
+
+def import_backend_at(name, ref):
+    '''
+    Imports a backend as it was at a git revision, returns None if its
+    source can't be read.
+    '''
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backends')
+    try:
+        source = subprocess.check_output(['git', 'show', '%s:./%s.py' % (ref, name)],
+                                         cwd=directory, stderr=subprocess.STDOUT)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    filename = os.path.join(directory, '%s.py@%s' % (name, ref))
+    module = types.ModuleType('ijson.backends.%s' % name)
+    module.__file__ = filename
+    try:
+        exec(compile(source, filename, 'exec'), module.__dict__)
+    except ImportError:
+        return None
+    return module
+
+
+def measure(method, backend, data, repeat):
+    '''
+    Runs a method several times, returns the best time in seconds.
+    '''
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        result = method(backend, data)
+        elapsed = result if result is not None else time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m ijson.benchmark',
+        description='Benchmarks ijson backends.')
+    parser.add_argument('-b', '--backends', nargs='+', default=BACKENDS,
+        choices=BACKENDS)
+    parser.add_argument('-m', '--methods', nargs='+',
+        default=sorted(METHODS), choices=sorted(METHODS))
+    parser.add_argument('-d', '--documents', nargs='+',
+        default=sorted(DOCUMENTS), choices=sorted(DOCUMENTS))
+    parser.add_argument('-r', '--repeat', type=int, default=3)
+    parser.add_argument('--ref', default=None,
+        help='also run the backends as they were at this git revision')
+    args = parser.parse_args(argv)
+
+    backends = [(name, import_backend(name)) for name in args.backends]
+    if args.ref is not None:
+        backends += [('%s@%s' % (name, args.ref), import_backend_at(name, args.ref))
+                     for name in args.backends]
+
+    for document in args.documents:
+        data = json.dumps(DOCUMENTS[document]()).encode('utf-8')
+        print('%s (%d bytes)' % (document, len(data)))
+
+        for name, backend in backends:
+            if backend is None:
+                print('  %-20s not available' % name)
+                continue
+
+            for method in args.methods:
+                try:
+                    elapsed = measure(METHODS[method], backend, data, args.repeat)
+                except (AttributeError, TypeError):
+                    # methods added after the revision
+                    print('  %-20s %-18s not supported' % (name, method))
+                    continue
+                print('  %-20s %-18s %10.3f ms' % (name, method, elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,12 @@
 '''
 Backend independent higher level interfaces, common exceptions.
 '''
+from array import array
 import decimal
+import json
+import re
+
+from ijson.compat import bytetype
 
 
 class JSONError(Exception):
@@ -18,7 +23,7 @@ class IncompleteJSONError(JSONError):
     pass
 
 
-def parse(basic_events):
+def parse(basic_events, tuple_paths=False, selector=None):
     '''
     An iterator returning parsing events with the information about their location
     with the JSON object tree. Events are tuples ``(prefix, type, value)``.
@@ -60,26 +65,67 @@ def parse(basic_events):
       ('map', 'end_map', None)
       ('', 'end_map', None)
 
+    With ``tuple_paths=True`` prefixes are tuples of keys instead, e.g.
+    ``('map', 'key')``, which are unambiguous when keys contain dots. In
+    arrays the key is ``'item'`` in both cases.
+
+    With a ``Selector``, only the events of the selected values are returned,
+    see ``select``.
+
     '''
-    path = []
+    if selector is not None:
+        return select(basic_events, selector, tuple_paths)
+    if tuple_paths:
+        return _parse_tuples(basic_events)
+    return _parse_strings(basic_events)
+
+
+def _parse_strings(basic_events):
+    # prefixes are kept on a stack, the top being the prefix of the next
+    # value, so that each event takes constant time regardless of depth
+    path = ['']
+    for event, value in basic_events:
+        if event == 'map_key':
+            prefix = path[-2]
+            path[-1] = prefix + '.' + value if len(path) > 2 else value
+        elif event == 'start_map':
+            prefix = path[-1]
+            path.append(None)
+        elif event == 'end_map':
+            path.pop()
+            prefix = path[-1]
+        elif event == 'start_array':
+            prefix = path[-1]
+            path.append(prefix + '.item' if len(path) > 1 else 'item')
+        elif event == 'end_array':
+            path.pop()
+            prefix = path[-1]
+        else: # any scalar value
+            prefix = path[-1]
+
+        yield prefix, event, value
+
+
+def _parse_tuples(basic_events):
+    path = [()]
     for event, value in basic_events:
         if event == 'map_key':
-            prefix = '.'.join(path[:-1])
-            path[-1] = value
+            prefix = path[-2]
+            path[-1] = prefix + (value,)
         elif event == 'start_map':
-            prefix = '.'.join(path)
+            prefix = path[-1]
             path.append(None)
         elif event == 'end_map':
             path.pop()
-            prefix = '.'.join(path)
+            prefix = path[-1]
         elif event == 'start_array':
-            prefix = '.'.join(path)
-            path.append('item')
+            prefix = path[-1]
+            path.append(prefix + ('item',))
         elif event == 'end_array':
             path.pop()
-            prefix = '.'.join(path)
+            prefix = path[-1]
         else: # any scalar value
-            prefix = '.'.join(path)
+            prefix = path[-1]
 
         yield prefix, event, value
 
@@ -150,11 +196,595 @@ def items(prefixed_events, prefix):
         pass
 
 
-def number(str_value):
+# events which have byte offsets as values when parsed with offsets
+CONTAINER_EVENTS = frozenset(['start_map', 'end_map', 'start_array', 'end_array'])
+
+
+class Recorder(object):
+    '''
+    Wraps a readable file and keeps the bytes read from it, so that raw
+    values can be cut out of the input by their byte offsets. Bytes before
+    an offset are dropped by ``discard`` once they are no longer needed.
+
+    While ``mark`` is the offset of a value being cut out, the bytes from
+    there are kept. Otherwise each read drops the bytes before the previous
+    chunk: the backends report the brackets of a chunk before reading the
+    next one, so the offsets still to come are in the last chunk read.
+    '''
+    def __init__(self, file):
+        self.file = file
+        self.data = bytearray()
+        self.start = 0
+        # offset of the last chunk read
+        self.last = 0
+        self.mark = None
+
+    def read(self, size):
+        data = self.file.read(size)
+        self.discard(self.last if self.mark is None else self.mark)
+        self.last = self.start + len(self.data)
+        if isinstance(data, bytetype):
+            self.data += data
+        else:
+            self.data += data.encode('utf-8')
+        return data
+
+    def slice(self, start, end):
+        return bytes(self.data[start - self.start:end - self.start])
+
+    def discard(self, offset):
+        if offset > self.start:
+            del self.data[:offset - self.start]
+            self.start = offset
+
+
+def fast_items(basic_events, prefix, recorder, use_float=False):
+    '''
+    Like ``items``, but maps and arrays under the prefix are decoded from
+    their raw bytes by a single ``json.loads`` instead of being built event
+    by event, which is much faster for small dense values. Their contents
+    are skipped without computing prefixes. Numbers are converted like by
+    ``number`` in both cases.
+
+    Events should be parsed with ``offsets=True`` from the ``recorder``
+    wrapping the input file. A tuple prefix selects tuple paths.
+    '''
+    # json only passes non-integer literals to parse_float, for which
+    # number() and float() agree with use_float
+    parse_float = float if use_float else number
+    basic_events = iter(basic_events)
+    # the end event of a skipped container, passed on to parse so that
+    # its prefixes stay in step
+    skipped = []
+
+    def source():
+        for event in basic_events:
+            yield event
+            if skipped:
+                yield skipped.pop()
+
+    prefixed_events = parse(source(), isinstance(prefix, tuple))
+    for current, event, value in prefixed_events:
+        if current == prefix:
+            if event == 'start_map' or event == 'start_array':
+                start = recorder.mark = value
+                depth = 1
+                for event, value in basic_events:
+                    if event == 'start_map' or event == 'start_array':
+                        depth += 1
+                    elif event == 'end_map' or event == 'end_array':
+                        depth -= 1
+                        if not depth:
+                            break
+                else:
+                    raise IncompleteJSONError('Incomplete JSON data')
+                skipped.append((event, value))
+                next(prefixed_events)
+                raw = recorder.slice(start, value)
+                recorder.mark = None
+                recorder.discard(value)
+                yield json.loads(raw.decode('utf-8'), parse_float=parse_float)
+            else:
+                yield value
+        elif event in CONTAINER_EVENTS:
+            # nothing before a container outside of the prefix is needed
+            recorder.discard(value)
+
+def kvitems(prefixed_events, prefix):
+    '''
+    An iterator returning ``(key, value)`` pairs of the maps under a given
+    prefix, with values constructed as native Python objects one at a time,
+    so that only one value of a large map is held in memory.
+    '''
+    prefixed_events = iter(prefixed_events)
+    try:
+        while True:
+            current, event, value = next(prefixed_events)
+            if current == prefix and event == 'map_key':
+                key = value
+                current, event, value = next(prefixed_events)
+                if event in ('start_map', 'start_array'):
+                    builder = ObjectBuilder()
+                    value_prefix = current
+                    end_event = event.replace('start', 'end')
+                    while (current, event) != (value_prefix, end_event):
+                        builder.event(event, value)
+                        current, event, value = next(prefixed_events)
+                    yield key, builder.value
+                else:
+                    yield key, value
+    except StopIteration:
+        pass
+
+
+def items_multi(prefixed_events, prefixes):
+    '''
+    An iterator returning ``(prefix, object)`` for native Python objects
+    constructed from the events under any of the given prefixes, in a single
+    pass. Events under other prefixes are only checked against the set of
+    prefixes. When a selected prefix is nested in another one, both objects
+    are returned, the inner one first.
+    '''
+    selected = frozenset(prefixes)
+    # builders of the objects being built, innermost last
+    building = []
+    for current, event, value in prefixed_events:
+        if building:
+            prefix, builder, end_event = building[-1]
+            if event == end_event and current == prefix:
+                building.pop()
+                for outer in building:
+                    outer[1].event(event, value)
+                yield prefix, builder.value
+                continue
+            for outer in building:
+                outer[1].event(event, value)
+
+        if current in selected:
+            if event == 'start_map' or event == 'start_array':
+                builder = ObjectBuilder()
+                builder.event(event, value)
+                building.append((current, builder, event.replace('start', 'end')))
+            elif event != 'map_key':
+                yield current, value
+
+
+# typecode of the string columns of ``columns``
+STRING = 's'
+
+# offsets of the strings in a StringColumn, 64 bits where available
+try:
+    array('Q')
+    _OFFSET_TYPECODE = 'Q'
+except ValueError:
+    _OFFSET_TYPECODE = 'L'
+
+
+class StringColumn(object):
+    '''
+    A column of strings stored as UTF-8 in a single bytearray with the
+    offsets of their ends in an array, rather than as a str object each.
+    Strings are decoded when they are indexed.
+    '''
+    def __init__(self):
+        self.data = bytearray()
+        self.ends = array(_OFFSET_TYPECODE)
+
+    def append(self, value):
+        self.data += value.encode('utf-8')
+        self.ends.append(len(self.data))
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self.ends)
+        end = self.ends[index]
+        start = self.ends[index - 1] if index else 0
+        return self.data[start:end].decode('utf-8')
+
+    def __iter__(self):
+        for index in range(len(self.ends)):
+            yield self[index]
+
+
+def _column(typecode):
+    return StringColumn() if typecode == STRING else array(typecode)
+
+
+# missing and null values of columns
+_FILL_VALUES = {'f': float('nan'), 'd': float('nan'), STRING: ''}
+
+
+def _append(column, field, value):
+    try:
+        column.append(value)
+    except (TypeError, OverflowError, AttributeError):
+        typecode = STRING if isinstance(column, StringColumn) else column.typecode
+        raise ValueError('%r can\'t be stored in column %r of type %r'
+                         % (value, field, typecode))
+
+
+def _to_numpy(column):
+    import numpy
+
+    if isinstance(column, StringColumn):
+        return numpy.array(list(column))
+    return numpy.frombuffer(column, dtype=column.typecode)
+
+
+def columns(prefixed_events, prefix, fields=None, types='d', use_numpy=False):
+    '''
+    Collects the values under a prefix into typed columns, which take the
+    machine size of each value instead of a Python object each.
+
+    Without ``fields``, the scalar values under the prefix, like the items of
+    an array of numbers, are returned as a single column. With ``fields``,
+    the values under the prefix should be maps, and a dict is returned with
+    a column for each field, other keys being ignored.
+
+    ``types`` are ``array`` typecodes, ``'s'`` for strings which are stored
+    in a ``StringColumn``. It is either one typecode for all columns, or a
+    typecode for each field. Missing and null values are stored as NaN in
+    float columns, 0 in integer columns and empty strings in string columns.
+
+    With ``use_numpy``, columns are returned as NumPy arrays, sharing the
+    memory of numeric columns.
+    '''
+    if fields is None:
+        column = _column(types)
+        fill = _FILL_VALUES.get(types, 0)
+        for current, event, value in prefixed_events:
+            if current == prefix:
+                if event in CONTAINER_EVENTS or event == 'map_key':
+                    raise ValueError('Values under %r should be scalars' % (prefix,))
+                _append(column, prefix, fill if value is None else value)
+        return _to_numpy(column) if use_numpy else column
+
+    fields = list(fields)
+    if len(types) == 1:
+        types = types * len(fields)
+    if len(types) != len(fields):
+        raise ValueError('Expected %d types, got %d' % (len(fields), len(types)))
+    indexes = dict((field, index) for index, field in enumerate(fields))
+    result = [_column(typecode) for typecode in types]
+    fills = [_FILL_VALUES.get(typecode, 0) for typecode in types]
+    row = None
+    prefixed_events = iter(prefixed_events)
+    for current, event, value in prefixed_events:
+        if current != prefix:
+            continue
+        if event == 'map_key':
+            index = indexes.get(value)
+            if index is not None:
+                current, event, value = next(prefixed_events)
+                if event in CONTAINER_EVENTS:
+                    raise ValueError('Field %r should be a scalar' % (fields[index],))
+                row[index] = value
+        elif event == 'start_map':
+            row = [None] * len(fields)
+        elif event == 'end_map':
+            for field, column, value, fill in zip(fields, result, row, fills):
+                _append(column, field, fill if value is None else value)
+        else:
+            raise ValueError('Values under %r should be maps' % (prefix,))
+    if use_numpy:
+        result = [_to_numpy(column) for column in result]
+    return dict(zip(fields, result))
+
+
+# a quoted or a plain component, up to the next dot
+_SELECTOR_COMPONENT = re.compile(r'"([^"]*)"(?=\.|$)|([^."]*)(?=\.|$)')
+
+
+class Selector(object):
+    '''
+    A path selector compiled from a dotted expression, or a tuple of its
+    components. Components are matched against the keys of the path, like
+    the prefixes of ``parse``, and may be:
+
+    - a key, ``item`` matching any array item
+    - a key in double quotes, which may contain dots and is matched as it
+      is, e.g. ``"key.name"``
+    - ``*`` matching any single key or array item
+    - ``**`` matching any number of keys and array items, including none
+    - ``item[start:stop]`` or ``item[index]`` matching array items by index,
+      either bound may be omitted
+
+    For example ``**."key.diagnostics".item`` selects the diagnostics of
+    SourceKitten output at any depth, ``*.name`` the names in the top-level
+    values, and ``item[0:10]`` the first ten items of a top-level array.
+    The tuple ``('**', 'key.diagnostics', 'item')`` selects the same as the
+    first one, its components are never split or unquoted.
+
+    The selector keeps a set of positions in its components for each level of
+    the document, so that the keys of a path are matched once, when they are
+    read, and subtrees which can't be selected are skipped.
+    '''
+    # step kinds
+    KEY, ANY, DESCEND, RANGE = range(4)
+
+    # limits the transitions cached for documents with many distinct keys
+    cache_size = 10000
+
+    def __init__(self, expression):
+        self.expression = expression
+        if isinstance(expression, tuple):
+            self.steps = [self._compile(component) for component in expression]
+        else:
+            self.steps = [(self.KEY, component) if quoted else self._compile(component)
+                          for component, quoted in self._split(expression)]
+
+        self.final = len(self.steps)
+        self.has_ranges = any(kind == self.RANGE for kind, arg in self.steps)
+        self.initial = self._closure([0])
+        self.cache = {}
+
+    def __repr__(self):
+        return 'Selector(%r)' % (self.expression,)
+
+    @staticmethod
+    def _split(expression):
+        # (component, quoted) pairs of a dotted expression
+        components = []
+        pos = 0
+        while expression:
+            match = _SELECTOR_COMPONENT.match(expression, pos)
+            if match is None:
+                raise ValueError('Invalid selector expression: %r' % expression)
+            quoted, plain = match.groups()
+            components.append((quoted, True) if quoted is not None else (plain, False))
+            if match.end() == len(expression):
+                break
+            pos = match.end() + 1
+        return components
+
+    def _compile(self, component):
+        if component == '*':
+            return self.ANY, None
+        if component == '**':
+            return self.DESCEND, None
+        match = re.match(r'item\[(\d*)(:?)(\d*)\]$', component)
+        if match is None:
+            if '[' in component:
+                raise ValueError('Invalid selector component: %r' % component)
+            return self.KEY, component
+        start, colon, stop = match.groups()
+        if not colon:
+            if not start or stop:
+                raise ValueError('Invalid selector component: %r' % component)
+            return self.RANGE, (int(start), int(start) + 1)
+        return self.RANGE, (int(start) if start else 0, int(stop) if stop else None)
+
+    def _closure(self, states):
+        # ``**`` also matches no keys at all
+        closure = set()
+        for state in states:
+            while state not in closure:
+                closure.add(state)
+                if state == self.final or self.steps[state][0] != self.DESCEND:
+                    break
+                state += 1
+        return frozenset(closure)
+
+    def transitions(self, states):
+        '''
+        Returns the dict of cached states after each key from the given
+        states.
+        '''
+        transitions = self.cache.get(states)
+        if transitions is None:
+            transitions = self.cache[states] = {}
+        return transitions
+
+    def step(self, states, key, index=None):
+        '''
+        Returns the states after a key of the path, which is ``'item'`` with
+        the index of the item in arrays and ``None`` otherwise.
+        '''
+        if not states:
+            return states
+        if index is not None and self.has_ranges:
+            return self._step(states, key, index)
+        transitions = self.transitions(states)
+        next_states = transitions.get(key)
+        if next_states is None:
+            if len(transitions) >= self.cache_size:
+                transitions.clear()
+            next_states = transitions[key] = self._step(states, key, index)
+        return next_states
+
+    def _step(self, states, key, index):
+        next_states = []
+        for state in states:
+            if state == self.final:
+                continue
+            kind, arg = self.steps[state]
+            if kind == self.DESCEND:
+                next_states.append(state)
+            elif kind == self.ANY or (kind == self.KEY and arg == key):
+                next_states.append(state + 1)
+            elif kind == self.RANGE and index is not None:
+                start, stop = arg
+                if start <= index and (stop is None or index < stop):
+                    next_states.append(state + 1)
+        return self._closure(next_states)
+
+
+class _Level(object):
+    '''
+    An open container while selecting events.
+    '''
+    __slots__ = ('states', 'keys', 'item_states', 'is_array', 'index', 'key',
+                 'prefix', 'selected')
+
+    def __init__(self, states, keys, item_states, is_array, prefix, selected):
+        self.states = states
+        self.keys = keys
+        self.item_states = item_states
+        self.is_array = is_array
+        self.index = 0
+        self.key = None
+        self.prefix = prefix
+        self.selected = selected
+
+
+def select(basic_events, selector, tuple_paths=False):
+    '''
+    An iterator returning the events of ``parse`` for the values selected by
+    a ``Selector``, including the events of their contents. Containers which
+    can't contain selected values are skipped, and prefixes are only computed
+    for selected values.
+    '''
+    for prefix, event, value, matched in _select(basic_events, selector, tuple_paths):
+        yield prefix, event, value
+
+
+def _select(basic_events, selector, tuple_paths, prefixes=True):
+    # yields (prefix, event, value, matched) for the events of selected
+    # values, matched is True for the events starting a selected value.
+    # Without prefixes, all of them are None.
+    root = () if tuple_paths else ''
+    step = selector.step
+    final = selector.final
+    stack = []
+
+    def next_prefix():
+        # the prefix of the next value, computing the missing prefixes of
+        # the containers on the stack
+        start = len(stack)
+        while start and stack[start - 1].prefix is None:
+            start -= 1
+        for depth in range(start, len(stack) + 1):
+            if not depth:
+                prefix = root
+            else:
+                parent = stack[depth - 1]
+                key = 'item' if parent.is_array else parent.key
+                if tuple_paths:
+                    prefix = parent.prefix + (key,)
+                elif depth == 1:
+                    prefix = key
+                else:
+                    prefix = parent.prefix + '.' + key
+            if depth < len(stack):
+                stack[depth].prefix = prefix
+        return prefix
+
+    # states of the next value
+    states = selector.initial
+    basic_events = iter(basic_events)
+    for event, value in basic_events:
+        if event == 'map_key':
+            level = stack[-1]
+            level.key = value
+            states = level.keys.get(value)
+            if states is None:
+                states = step(level.states, value)
+            if level.selected:
+                yield level.prefix, event, value, False
+            continue
+
+        if event == 'end_map' or event == 'end_array':
+            level = stack.pop()
+            if level.selected:
+                yield level.prefix, event, value, False
+            continue
+
+        selected = False
+        if stack:
+            level = stack[-1]
+            selected = level.selected
+            if level.is_array:
+                states = level.item_states
+                if states is None:
+                    states = step(level.states, 'item', level.index)
+                level.index += 1
+
+        if not states and not selected:
+            if event == 'start_map' or event == 'start_array':
+                depth = 1
+                for event, value in basic_events:
+                    if event == 'start_map' or event == 'start_array':
+                        depth += 1
+                    elif event == 'end_map' or event == 'end_array':
+                        depth -= 1
+                        if not depth:
+                            break
+            continue
+
+        matched = final in states
+        if not prefixes:
+            prefix = None
+            if selected and not states and (event == 'start_map' or event == 'start_array'):
+                # the contents can't be matched, pass them through
+                yield prefix, event, value, False
+                depth = 1
+                for event, value in basic_events:
+                    if event == 'start_map' or event == 'start_array':
+                        depth += 1
+                    elif event == 'end_map' or event == 'end_array':
+                        depth -= 1
+                    yield prefix, event, value, False
+                    if not depth:
+                        break
+                continue
+        elif selected or matched:
+            prefix = next_prefix()
+        else:
+            prefix = None
+        if event == 'start_map':
+            stack.append(_Level(states, selector.transitions(states), None,
+                                False, prefix, selected or matched))
+        elif event == 'start_array':
+            # without index ranges, all items have the same states
+            item_states = None if selector.has_ranges else step(states, 'item')
+            stack.append(_Level(states, None, item_states, True, prefix,
+                                selected or matched))
+        if selected or matched:
+            yield prefix, event, value, matched
+
+
+def select_items(basic_events, selector):
+    '''
+    An iterator returning native Python objects constructed from the values
+    selected by a ``Selector``. When a selected value contains other selected
+    values, all of them are returned, inner ones first.
+    '''
+    building = []
+    for prefix, event, value, matched in _select(basic_events, selector, False, False):
+        for builder in building:
+            builder.event(event, value)
+        if matched:
+            if event == 'start_map' or event == 'start_array':
+                builder = ObjectBuilder()
+                builder.event(event, value)
+                building.append(builder)
+            else:
+                yield value
+        elif (event == 'end_map' or event == 'end_array') and len(building[-1].containers) == 1:
+            yield building.pop().value
+
+
+def number(str_value, use_float=False):
     '''
-    Converts string with a numeric value into an int or a Decimal.
+    Converts string with a numeric value into an int or a Decimal, or a
+    float with ``use_float``. Integer literals, the most common ones, are
+    converted with ``int`` directly.
     Used in different backends for consistent number representation.
     '''
+    if '.' not in str_value and 'e' not in str_value and 'E' not in str_value:
+        try:
+            return int(str_value)
+        except ValueError:
+            pass
+    if use_float:
+        number = float(str_value)
+        # float() also accepts nan and inf, which are no JSON numbers
+        if number - number != 0 and not any(c.isdigit() for c in str_value):
+            raise ValueError('Invalid number: %r' % str_value)
+        return number
     number = decimal.Decimal(str_value)
     int_number = int(number)
     if int_number == number:
@@ -0,0 +1,155 @@
+# -*- coding:utf-8 -*-
+from __future__ import unicode_literals
+import unittest
+from io import BytesIO
+from importlib import import_module
+
+from ijson import common
+from ijson.compat import IS_PY2
+
+
+STRUCTURE = b'''
+{
+  "key.diagnostics": [
+    {"key.line": 3, "key.description": "expected expression"}
+  ],
+  "key.substructure": [
+    {
+      "key.kind": "source.lang.swift.decl.class",
+      "key.name": "Foo",
+      "key.substructure": [
+        {"key.kind": "source.lang.swift.decl.function.method.instance", "key.name": "bar()"}
+      ]
+    }
+  ]
+}
+'''
+
+
+# positional arguments of basic_parse in each backend: (buf_size,) or the
+# arguments with comments allowed and a buffer size of 3
+POSITIONAL_ARGS = {
+    'python': (3,),
+    'yajl': (True, False, 3),
+    'yajl2': (True, 3),
+    'yajl2_cffi': (3, True),
+}
+
+
+class ReadSizes(BytesIO):
+    '''
+    Records the sizes of reads.
+    '''
+    def __init__(self, data):
+        BytesIO.__init__(self, data)
+        self.sizes = []
+
+    def read(self, size=-1):
+        self.sizes.append(size)
+        return BytesIO.read(self, size)
+
+
+class PeakRecorder(common.Recorder):
+    '''
+    Records the largest number of bytes kept after a read.
+    '''
+    peak = 0
+
+    def read(self, size):
+        data = common.Recorder.read(self, size)
+        self.peak = max(self.peak, len(self.data))
+        return data
+
+
+class Parse(object):
+    '''
+    Base class for parsing tests that is used to create test cases for each
+    available backends.
+    '''
+    def fast_items_peak(self, doc, prefix):
+        recorder = PeakRecorder(BytesIO(doc))
+        events = self.backend.basic_parse(recorder, buf_size=1024, offsets=True)
+        items = list(common.fast_items(events, prefix, recorder))
+        return items, recorder.peak
+
+    def test_fast_items_bounded(self):
+        numbers = b'[' + b', '.join(str(i).encode('ascii') for i in range(50000)) + b']'
+        items, peak = self.fast_items_peak(numbers, 'item')
+        self.assertEqual(items, list(range(50000)))
+        self.assertTrue(peak <= 2 * 1024, peak)
+
+        records = b'[' + b', '.join([b'{"a": [1, 2]}'] * 1000) + b']'
+        for doc in [b'{"meta": "' + b'x' * 100000 + b'", "items": ' + records + b'}',
+                    b'{"meta": ' + numbers + b', "items": ' + records + b'}']:
+            items, peak = self.fast_items_peak(doc, 'items.item')
+            self.assertEqual(items, [{'a': [1, 2]}] * 1000)
+            self.assertTrue(peak <= 2 * 1024, peak)
+
+    def test_fast_items_subtree(self):
+        doc = b'[{"a": "' + b'x' * 10000 + b'"}, 1]'
+        items, peak = self.fast_items_peak(doc, 'item')
+        self.assertEqual(items, [{'a': 'x' * 10000}, 1])
+
+    def test_basic_parse_positional(self):
+        args = POSITIONAL_ARGS[self.backend.__name__.rsplit('.', 1)[1]]
+        doc = b'[1, {"a": null}]' if len(args) == 1 else b'/* c */ [1, {"a": null}]'
+        f = ReadSizes(doc)
+        events = list(self.backend.basic_parse(f, *args))
+        self.assertEqual(events, [
+            ('start_array', None), ('number', 1), ('start_map', None),
+            ('map_key', 'a'), ('null', None), ('end_map', None), ('end_array', None),
+        ])
+        self.assertEqual(max(f.sizes), 3)
+
+    def test_selector_dotted_keys(self):
+        selector = common.Selector('**."key.diagnostics".item."key.line"')
+        self.assertEqual(list(self.backend.items(BytesIO(STRUCTURE), selector)), [3])
+
+    def test_selector_dotted_keys_nested(self):
+        expected = ['Foo', 'bar()']
+        for selector in [common.Selector('**."key.substructure".item."key.name"'),
+                         common.Selector(('**', 'key.substructure', 'item', 'key.name'))]:
+            names = list(self.backend.items(BytesIO(STRUCTURE), selector))
+            self.assertEqual(names, expected)
+
+
+# Generating real TestCase classes for each importable backend
+for name in ['python', 'yajl', 'yajl2', 'yajl2_cffi']:
+    try:
+        classname = '%sParse' % ''.join(p.capitalize() for p in name.split('_'))
+        if IS_PY2:
+            classname = classname.encode('ascii')
+
+        locals()[classname] = type(
+            classname,
+            (unittest.TestCase, Parse),
+            {'backend': import_module('ijson.backends.%s' % name)},
+        )
+    except ImportError:
+        # yajl or cffi not installed
+        pass
+
+
+class Common(unittest.TestCase):
+    '''
+    Backend independent tests.
+    '''
+    def test_selector_split(self):
+        selector = common.Selector('a."b.c"."*".*')
+        self.assertEqual(selector.steps, [
+            (selector.KEY, 'a'), (selector.KEY, 'b.c'),
+            (selector.KEY, '*'), (selector.ANY, None),
+        ])
+
+    def test_selector_unquoted_dotted_keys(self):
+        selector = common.Selector('key.diagnostics.item')
+        self.assertEqual(list(common.select_items(
+            import_module('ijson.backends.python').basic_parse(BytesIO(STRUCTURE)),
+            selector)), [])
+
+    def test_selector_invalid_quotes(self):
+        self.assertRaises(ValueError, common.Selector, '"key.name"x')
+
+
+if __name__ == '__main__':
+    unittest.main()
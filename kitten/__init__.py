@@ -0,0 +1,26 @@
+"""
+SwiftKitten completion core.
+
+The parts of SwiftKitten which do not depend on the Sublime API: stub
+extraction, the completion cache, the request scheduler and parsing of
+SourceKitten completion results (`kitten.core`), and a JSON-RPC server
+exposing them to the plugin over a Unix socket (`kitten.server`).
+
+Both run inside the Sublime plugin host, or standalone with
+
+    python -m kitten.server serve --socket PATH
+
+from the SwiftKitten package directory.
+"""
+import os
+import sys
+
+# dependency paths
+package_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+packages = ["ijson", "cffi", "pycparser"]
+paths = [os.path.join(package_path, package) for package in packages]
+
+# add paths
+for path in paths:
+    if path not in sys.path:
+        sys.path.append(path)
@@ -0,0 +1,1108 @@
+"""
+Completion core: stub extraction, completion cache, request scheduler and
+parsing of SourceKitten completion results.
+"""
+import os
+import re
+import time
+import signal
+import random
+import shlex
+import json
+import hashlib
+import logging
+import functools
+import importlib
+import itertools
+import threading
+from collections import OrderedDict
+
+
+
+class LazyImport(object):
+    """Stands in for a module, which is imported on first attribute access,
+    so that loading SwiftKitten does not pay for dependencies until they
+    are used.
+    """
+
+    def __init__(self, name, load=None):
+        """
+        """
+        # private names, which do not hide attributes of the module
+        self._name = name
+        self._load = load or functools.partial(importlib.import_module, name)
+        self._module = None
+
+
+    def __getattr__(self, attr):
+        """
+        """
+        if self._module is None:
+            self._module = self._load()
+        return getattr(self._module, attr)
+
+
+
+def import_ijson():
+    """
+    """
+    try:
+        # fast yajl backend
+        import ijson.backends.yajl2_cffi as backend
+    except:
+        # pure python backend
+        logging.warning("Failed to import yajl2_cffi backend for ijson.")
+        import ijson as backend
+    return backend
+
+
+
+# import dependencies on first use
+ijson = LazyImport("ijson", import_ijson)
+pickle = LazyImport("pickle")
+subprocess = LazyImport("subprocess")
+Token = LazyImport("pygments.token",
+    lambda: importlib.import_module("pygments.token").Token)
+
+
+# regexes for formatting function args in completion request
+prog = re.compile(r"<#T##(.+?)#>")
+arg_prog = re.compile(r"##.+")
+
+
+
+class AutocompleteRequestError(RuntimeError):
+    def __init__(self,*args,**kwargs):
+        RuntimeError.__init__(self,*args,**kwargs)
+
+
+
+class SourceKittenError(RuntimeError):
+    def __init__(self,*args,**kwargs):
+        RuntimeError.__init__(self,*args,**kwargs)
+
+
+
+class CircuitBreaker(object):
+    """Stops running a SourceKitten command after repeated failures.
+
+    After `threshold` consecutive failures or timeouts, the breaker
+    opens, and no requests are made for a delay which doubles with each
+    failure (plus up to 50% random jitter), up to `max_delay` seconds.
+    After the delay, a single trial request is let through (half open),
+    which closes the breaker if it succeeds.
+    """
+
+    def __init__(self, threshold=3, delay=1.0, max_delay=60.0):
+        """
+        """
+        self.threshold = threshold
+        self.delay = delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.retry_at = 0
+        self.trial = False
+
+
+    @property
+    def state(self):
+        """
+        """
+        if self.failures < self.threshold:
+            return "closed"
+        elif self.trial or time.time() >= self.retry_at:
+            return "half_open"
+        else:
+            return "open"
+
+
+    def allow(self):
+        """Check if a request may run. In the half open state, only one
+        trial request is allowed until it finishes.
+        """
+        with self.lock:
+            state = self.state
+            if state == "half_open":
+                if self.trial:
+                    return False
+                self.trial = True
+            return state != "open"
+
+
+    def success(self):
+        """
+        """
+        with self.lock:
+            self.failures = 0
+            self.trial = False
+
+
+    def failure(self):
+        """
+        """
+        with self.lock:
+            self.failures += 1
+            self.trial = False
+
+            if self.failures >= self.threshold:
+                exponent = self.failures - self.threshold
+                delay = min(self.delay * 2 ** exponent, self.max_delay)
+                self.retry_at = time.time() + delay * (1 + random.random() / 2)
+
+
+    def get_state(self):
+        """Get state, and seconds until the next trial request.
+        """
+        return {
+            "state"    : self.state,
+            "retry_in" : max(0, self.retry_at - time.time())
+        }
+
+
+
+# circuit breakers by SourceKitten command
+breakers = {}
+breakers_lock = threading.Lock()
+
+
+
+def get_breaker(command):
+    """
+    """
+    with breakers_lock:
+        if command not in breakers:
+            breakers[command] = CircuitBreaker()
+        return breakers[command]
+
+
+
+def get_breaker_states():
+    """Get the state of all breakers which are not closed.
+    """
+    with breakers_lock:
+        items = list(breakers.items())
+
+    states = {}
+    for command, breaker in items:
+        state = breaker.get_state()
+        if state["state"] != "closed":
+            states[command] = state
+
+    return states
+
+
+
+def run_sourcekitten(command, cmd, parse, timeout=None):
+    """Run a SourceKitten command line, and return the result of parse
+    called with its output.
+
+    A watchdog kills the process (and its children) after timeout
+    seconds. Failures and timeouts are recorded in the circuit breaker
+    of command, and SourceKittenError is raised, also if the breaker is
+    open.
+    """
+    breaker = get_breaker(command)
+
+    if not breaker.allow():
+        raise SourceKittenError("SourceKitten {command} requests paused "
+            "after repeated failures.".format(command=command))
+
+    # unbuffered, so that reads return as soon as output is available
+    try:
+        p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT, bufsize=0, start_new_session=True)
+    except Exception as e:
+        # also ends a trial request of the half open breaker
+        breaker.failure()
+        raise SourceKittenError("SourceKitten {command} failed: {error}".format(
+            command=command, error=e))
+
+    expired = []
+
+    def kill():
+        try:
+            os.killpg(p.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def expire():
+        expired.append(True)
+        kill()
+
+    watchdog = threading.Timer(timeout, expire) if timeout else None
+    error = None
+
+    try:
+        if watchdog is not None:
+            watchdog.daemon = True
+            watchdog.start()
+
+        result = parse(p.stdout)
+        # parse may stop reading before the end of the output
+        if p.poll() is None:
+            kill()
+        p.wait()
+    except Exception as e:
+        error = e
+        kill()
+        p.wait()
+    finally:
+        p.stdout.close()
+        if watchdog is not None:
+            watchdog.cancel()
+
+    if expired:
+        breaker.failure()
+        raise SourceKittenError("SourceKitten {command} timed out "
+            "after {timeout} s.".format(command=command, timeout=timeout))
+
+    if error is not None:
+        breaker.failure()
+        raise SourceKittenError("SourceKitten {command} failed: {error}".format(
+            command=command, error=error))
+
+    breaker.success()
+    return result
+
+
+
+def get_tokens_reversed(lexer, text):
+    """
+    """
+    lines = text.splitlines()
+    for line in lines[::-1]:
+        tokens = reversed(list(lexer.get_tokens(line)))
+        yield from tokens
+
+
+
+def get_autocomplete_stub(lexer, text):
+    """
+    """
+    entity = []
+
+    # ignored tokens
+    ignored = [Token.Comment, Token.Text, Token.Text.Whitespace, Token.Comment.Single]
+    filtered = lambda pair: pair[0] not in ignored  # pair = (token,value)
+
+    tokens = filter(filtered, get_tokens_reversed(lexer, text))
+    blocks = get_blocks(tokens)
+    block = next(blocks, [])
+
+    if len(block) == 1 and block[0][1] == ".":
+        block = next(blocks, [])
+        suffix = []
+
+        # optional chaining, e.g. foo?. or foo!.
+        if len(block) == 1 and block[0][1] in ("?", "!"):
+            suffix = block
+            block = next(blocks, [])
+
+        if len(block) > 0 and block[0][1] == "(":
+            block_ = next(blocks, [])
+
+            if len(block_) == 1 and block_[0][0] in Token.Name:
+                return block_ + block + suffix
+
+        return block + suffix if block else []
+
+    return []
+
+
+
+def get_blocks(tokens):
+    """
+    """
+    block = []
+    level = 0
+
+    for token, value in tokens:
+        block.append((token,value))
+
+        if value == ")":
+            level += 1
+        elif value == "(":
+            level -= 1
+
+        if level == 0:
+            yield block[::-1]
+            block = []
+
+
+
+def serialize_token(pair):
+    """Get string representation of (token, value) pair.
+    """
+    token, value = pair
+    # for literals, autocomplete only depends
+    # on type of argument, not the value
+    if token in [Token.Literal.Number.Float,
+                 Token.Literal.Number.Integer,
+                 Token.Literal.String]:
+        return str(token)
+    else:
+        return value
+
+
+
+def canonicalize_stub(stub, options):
+    """Get the cache key for a stub.
+
+    Stubs which yield the same completions should map to the same key.
+    With the default options:
+
+      - whitespace is removed from token values,
+      - optional chaining and forced unwrapping are treated alike,
+        e.g. foo!. -> foo?
+
+    With the `arguments` option, call arguments are reduced to their
+    labels and the kind of literal values, e.g. foo(x: bar) -> foo(x:_)
+    and foo(1) -> foo(Token.Literal.Number.Integer). This assumes that
+    the result type does not depend on the values of other arguments,
+    which does not hold for generic functions, so it is off by default.
+    """
+    serialize = serialize_token
+
+    def serialize_argument(arg):
+        label = ""
+        if len(arg) > 1 and arg[1][1] == ":" and arg[0][0] in Token.Name:
+            label = serialize(arg[0]) + ":"
+            arg = arg[2:]
+
+        # literals keep their kind, anything else is reduced
+        if arg and all(token in Token.Literal or token in Token.Keyword.Constant
+                       for token, value in arg):
+            return label + serialize(arg[0])
+        return label + "_"
+
+    if options.get("whitespace", True):
+        serialize = lambda pair: re.sub(r"\s+", "", serialize_token(pair))
+
+    if options.get("optional_chaining", True):
+        stub = [(token, "?" if value == "!" else value) for token, value in stub]
+
+    # only calls, not parenthesized expressions
+    if not options.get("arguments", False) or len(stub) < 2 or \
+            stub[0][0] not in Token.Name or stub[1][1] != "(":
+        return "".join(map(serialize, stub))
+
+    key = [serialize(stub[0]), "("]
+    args = []
+    arg = []
+    level = 0
+
+    for token, value in stub[2:]:
+        if value == "(":
+            level += 1
+        elif value == ")":
+            level -= 1
+
+        if level < 0:
+            # end of argument list
+            if arg:
+                args.append(arg)
+            key.append(",".join(map(serialize_argument, args)))
+            key.append(")")
+            arg = None
+            level = 0
+        elif arg is None:
+            # tokens after the argument list, e.g. optional chaining
+            key.append(serialize((token, value)))
+        elif level == 0 and value == ",":
+            args.append(arg)
+            arg = []
+        else:
+            arg.append((token, value))
+
+    return "".join(key)
+
+
+
+def get_completion_cmd(sourcekitten_binary, text, offset, compilerargs):
+    """Get completion command.
+    """
+    cmd = "{sourcekitten_binary} complete --text {text} --offset {offset} -- {compilerargs}"
+    return cmd.format(
+        sourcekitten_binary=sourcekitten_binary,
+        text=shlex.quote(text),
+        offset=offset,
+        compilerargs=shlex.quote(compilerargs)
+    )
+
+
+
+def _format_match(index, match):
+    """
+    """
+    index[0] += 1
+    arg = arg_prog.sub("", match.group(1))
+    return "${%s:%s}" % (index[0], arg)
+
+
+
+def format_snippet(text):
+    """
+    """
+    index = [0]
+    snippet = prog.sub(functools.partial(_format_match, index), text)
+    return snippet
+
+
+
+def format_completion(entry):
+    """
+    """
+    description = entry["descriptionKey"]
+    hint = entry["docBrief"] if "docBrief" in entry else entry["typeName"]
+    snippet = format_snippet(entry["sourcetext"]).strip(".")
+    return [description + '\t' + hint, snippet]
+
+
+
+def parse_completions(parser, included=lambda item: True):
+    """Parse and format completion data from a ijson parser.
+    """
+    item = None
+    item_ids = set()
+    for prefix, event, value in parser:
+        if event == "start_map":
+            item = {}
+        elif event == "end_map":
+            # exclude duplicates
+            item_id = item.get("associatedUSRs", item["name"])
+            if included(item) and item_id not in item_ids:
+                item_ids.add(item_id)
+                # yield formatted completion
+                yield format_completion(item)
+        elif event == "map_key":
+            item[value] = next(parser)[2]
+
+
+
+# declaration keys read from structure info
+structure_keys = set([
+    "key.name",
+    "key.kind",
+    "key.typename",
+    "key.offset",
+    "key.length",
+    "key.bodyoffset",
+    "key.bodylength",
+    "key.substructure"
+])
+
+
+
+def read_structure(parser, depth=None):
+    """Read structure info from a ijson parser.
+
+    Only diagnostics and declarations (with the keys in `structure_keys`,
+    down to depth levels of nesting) are kept, and reading stops as soon
+    as both are complete, without waiting for the rest of the output.
+    """
+    from ijson.common import ObjectBuilder
+
+    builder = ObjectBuilder()
+    remaining = set(["key.diagnostics", "key.substructure"])
+    skipped = 0
+    skip_value = False
+
+    for prefix, event, value in parser:
+        # skip the value of a dropped key
+        if skipped:
+            if event in ("start_map", "start_array"):
+                skipped += 1
+            elif event in ("end_map", "end_array"):
+                skipped -= 1
+            continue
+        if skip_value:
+            skip_value = False
+            if event in ("start_map", "start_array"):
+                skipped = 1
+            continue
+
+        if event == "map_key":
+            if prefix == "":
+                keep = value in remaining
+            elif prefix.startswith("key.substructure"):
+                level = prefix.count("key.substructure")
+                keep = value in structure_keys and not (
+                    value == "key.substructure" and level == depth)
+            else:
+                keep = True
+
+            if not keep:
+                skip_value = True
+                continue
+
+        builder.event(event, value)
+
+        if event == "end_array" and prefix in remaining:
+            remaining.discard(prefix)
+            if not remaining:
+                break
+
+    return getattr(builder, "value", {})
+
+
+
+def included_framework_item(item):
+    """Filter for framework globals in completion results.
+    """
+    return item["context"] == "source.codecompletion.context.othermodule" and \
+           item["moduleName"] != "Swift"
+
+
+
+class Scheduler(object):
+    """Runs requests on worker threads.
+
+    Each request has a key, e.g. the stub of a completion request. A
+    request for a key which is already in progress joins the running
+    request instead of starting another one.
+    """
+
+    # number of finished requests to keep results of
+    history = 64
+
+
+    def __init__(self):
+        """
+        """
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+
+        # key -> request id, for running requests
+        self.running = {}
+
+        # request id -> (event, result)
+        self.requests = OrderedDict()
+
+
+    def submit(self, key, func, limit=4):
+        """Run func in a worker thread, and return the request id.
+
+        Raises AutocompleteRequestError if limit requests are running.
+        """
+        with self.lock:
+            if key in self.running:
+                return self.running[key]
+
+            # do not overload the system with too many requests
+            if len(self.running) >= limit:
+                raise AutocompleteRequestError("Request denied: too many concurrent requests.")
+
+            request = str(next(self.ids))
+            self.running[key] = request
+            self.requests[request] = (threading.Event(), None)
+
+            # drop the oldest finished requests, others are waited for
+            running = set(self.running.values())
+            excess = len(self.requests) - self.history - len(running)
+            if excess > 0:
+                finished = [r for r in self.requests if r not in running]
+                for r in finished[:excess]:
+                    del self.requests[r]
+
+        threading.Thread(target=self._run, args=(key, request, func)).start()
+        return request
+
+
+    def _run(self, key, request, func):
+        """
+        """
+        result = None
+        try:
+            result = func()
+        except Exception as e:
+            print("SwiftKitten: request failed:", e)
+        finally:
+            with self.lock:
+                del self.running[key]
+                event, _ = self.requests.get(request, (threading.Event(), None))
+                self.requests[request] = (event, result)
+            event.set()
+
+
+    def wait(self, request, timeout=None):
+        """Wait for a request to finish, and return its result.
+        """
+        event, _ = self.requests.get(request, (None, None))
+        if event is None or not event.wait(timeout):
+            return None
+        return self.requests.get(request, (None, None))[1]
+
+
+    def is_running(self, request):
+        """
+        """
+        with self.lock:
+            return request in self.running.values()
+
+
+
+class PersistentCache(object):
+    """Completion results of a project, stored on disk.
+
+    Each entry is a file named by the hash of its key. Reading an entry
+    updates its modification time, and the least recently used entries
+    are removed when the files exceed max_size bytes.
+    """
+
+    def __init__(self, path, max_size):
+        """
+        """
+        self.path = path
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.size = None
+
+
+    def _entry_path(self, key):
+        """
+        """
+        digest = hashlib.sha1(json.dumps(key).encode("utf-8")).hexdigest()
+        return os.path.join(self.path, digest + ".cache")
+
+
+    def get(self, key):
+        """Get completions for key, or None.
+        """
+        entry_path = self._entry_path(key)
+
+        try:
+            with open(entry_path, "rb") as f:
+                entry_key, completions = pickle.load(f)
+            os.utime(entry_path, None)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+        # hash collision
+        if entry_key != key:
+            return None
+
+        return completions
+
+
+    def put(self, key, completions):
+        """
+        """
+        entry_path = self._entry_path(key)
+        data = pickle.dumps((key, completions), pickle.HIGHEST_PROTOCOL)
+
+        with self.lock:
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+
+            if self.size is None:
+                self.size = sum(size for path, mtime, size in self._entries())
+
+            if os.path.exists(entry_path):
+                self.size -= os.path.getsize(entry_path)
+
+            # write to a temporary file, so that readers
+            # never see a partially written entry
+            temp_path = entry_path + ".tmp"
+            with open(temp_path, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, entry_path)
+
+            self.size += len(data)
+
+            if self.size > self.max_size:
+                self._evict()
+
+
+    def _entries(self):
+        """Get (path, mtime, size) of all entries.
+        """
+        entries = []
+
+        for name in os.listdir(self.path):
+            if name.endswith(".cache"):
+                path = os.path.join(self.path, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_mtime, stat.st_size))
+
+        return entries
+
+
+    def _evict(self):
+        """Remove least recently used entries, down to 3/4 of max_size.
+        """
+        entries = sorted(self._entries(), key=lambda entry: entry[1])
+        self.size = sum(size for path, mtime, size in entries)
+
+        for path, mtime, size in entries:
+            if self.size <= self.max_size * 3 // 4:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            self.size -= size
+
+
+
+class CompletionEngine(object):
+    """Completion cache and SourceKitten requests.
+
+    All arguments and results are plain JSON types, so an engine can be
+    used directly or through `kitten.server`. Options are a dict with the
+    `sourcekitten_binary`, `compilerargs`, `cache_timeout` and
+    `concurrent_request_limit` settings.
+
+    With a cache path, completions are also kept in a `PersistentCache`
+    for each project, if options have a `persistent_cache_size` and the
+    `project`, `file_name` and `imports` of the buffer.
+    """
+
+    def __init__(self, cache_path=None):
+        """
+        """
+        self.cache_path = cache_path
+
+        # cache of completion data
+        self.cache = {}
+        self.framework_cache = {}
+        self.persistent_caches = {}
+
+        # set once the framework cache on disk is loaded, see
+        # `load_framework_cache`
+        self.framework_cache_lock = threading.Lock()
+        self.framework_cache_loaded = threading.Event()
+        if cache_path is None:
+            self.framework_cache_loaded.set()
+
+        # serialized stubs recently queried in each buffer, before
+        # canonicalization, at most `raw_stub_limit` per buffer
+        self.raw_stubs = {}
+        self.raw_stub_limit = 256
+
+        # completion statistics
+        self.stats = {
+            "queries"        : 0,
+            "hits"           : 0,
+            "canonical_hits" : 0,
+            "disk_hits"      : 0
+        }
+
+        self.scheduler = Scheduler()
+
+        # pygments Swift language parser, created on first use
+        self.lexer = None
+
+
+    def get_stub(self, text, canonicalization=None):
+        """Get the stub of a completion at the end of text, for example:
+
+          foo.         -> foo
+          foo(bar).baz -> foo(bar)
+          (foo + bar). -> (foo+bar)
+
+        Returns the cache key, and the serialized stub before
+        canonicalization.
+        """
+        if self.lexer is None:
+            from pygments.lexers import SwiftLexer
+            self.lexer = SwiftLexer()
+
+        stub = get_autocomplete_stub(self.lexer, text)
+        raw_stub = "".join(map(serialize_token, stub))
+        return canonicalize_stub(stub, canonicalization or {}), raw_stub
+
+
+    def complete(self, buffer_id, stub, raw_stub, text, offset, options, reduced=None):
+        """Get cached completions for stub in a buffer, and request them
+        from SourceKitten if they are not cached or out of date.
+
+        If reduced is a (text, offset) pair, it is requested first, and
+        text only if the reduced request returns nothing. Completions
+        loaded from the persistent cache are `stale`, and revalidated
+        right away. Returns a dict with the cached `completions`, whether
+        the stub was `cached` and is `stale`, and the `request` id to
+        `wait` for, or None.
+
+        If text is None, nothing is requested, and `outdated` tells
+        whether completions should be requested with `refresh`, so that
+        a client only sends the text when it is needed.
+        """
+        cache = self.cache.setdefault(buffer_id, {})
+        raw_stubs = self.raw_stubs.setdefault(buffer_id, OrderedDict())
+        entry = cache.get(stub)
+        request = None
+
+        self.stats["queries"] += 1
+
+        if entry is not None:
+            self.stats["hits"] += 1
+            if raw_stub not in raw_stubs:
+                self.stats["canonical_hits"] += 1
+        else:
+            entry = self._load_persistent(stub, options)
+            if entry is not None:
+                cache[stub] = entry
+                self.stats["disk_hits"] += 1
+
+        raw_stubs[raw_stub] = True
+        raw_stubs.move_to_end(raw_stub)
+        if len(raw_stubs) > self.raw_stub_limit:
+            raw_stubs.popitem(last=False)
+
+        # if cached completion data still valid, do not make request
+        outdated = entry is None or \
+            time.time() - entry["timestamp"] > options.get("cache_timeout", 1.0)
+        if outdated and text is not None:
+            request = self.refresh(buffer_id, stub, text, offset, options, reduced)
+
+        return {
+            "completions" : entry["completions"] if entry is not None else [],
+            "cached"      : entry is not None,
+            "stale"       : entry is not None and entry.get("stale", False),
+            "outdated"    : outdated,
+            "request"     : request
+        }
+
+
+    def refresh(self, buffer_id, stub, text, offset, options, reduced=None):
+        """Request completions for stub in a buffer from SourceKitten,
+        see `complete`. Returns the request id to `wait` for, or None.
+        """
+        _autocomplete = functools.partial(self._autocomplete,
+            buffer_id, stub, text, offset, options, reduced)
+        return self._submit((buffer_id, stub), _autocomplete, options)
+
+
+    def complete_frameworks(self, frameworks, prefix, options):
+        """Get cached globals of frameworks matching prefix, and request
+        globals of frameworks which are not cached.
+
+        Until the framework cache on disk is loaded, its loading is
+        started and nothing is requested, since framework requests are
+        slow and most frameworks are usually cached.
+        """
+        completions = []
+
+        if not self.framework_cache_loaded.is_set():
+            if not self.framework_cache_lock.locked():
+                threading.Thread(target=self.load_framework_cache).start()
+            return completions
+
+        for framework in frameworks:
+            if framework in self.framework_cache:
+                # disable fuzzy matching for globals
+                completions += [item for item in self.framework_cache[framework]
+                                if item[0].startswith(prefix)]
+            else:
+                _autocomplete_framework = functools.partial(
+                    self._autocomplete_framework, framework, options)
+                self._submit(("." + framework,), _autocomplete_framework, options)
+
+        return completions
+
+
+    def wait(self, request, timeout=None):
+        """Wait for a completion request to finish.
+
+        Returns True if it changed the cached completions, or None if it
+        is still running after timeout seconds. Clients of the server
+        wait with a timeout in a loop, rather than holding a connection
+        for as long as SourceKitten runs.
+        """
+        changed = self.scheduler.wait(request, timeout)
+        if not changed and self.scheduler.is_running(request):
+            return None
+        return bool(changed)
+
+
+    def get_stats(self):
+        """
+        """
+        return dict(self.stats)
+
+
+    def clear_cache(self):
+        """
+        """
+        self.cache = {}
+        self.framework_cache = {}
+        self.raw_stubs = {}
+
+
+    def close_buffer(self, buffer_id):
+        """Drop the cached completions and stubs of a closed buffer.
+        """
+        self.cache.pop(buffer_id, None)
+        self.raw_stubs.pop(buffer_id, None)
+
+
+    def load_framework_cache(self):
+        """Load the framework cache from disk, unless it is loaded.
+        """
+        with self.framework_cache_lock:
+            if self.framework_cache_loaded.is_set():
+                return
+
+            try:
+                framework_cache_path = os.path.join(self.cache_path, "frameworks.cache")
+
+                if os.path.exists(framework_cache_path):
+                    with open(framework_cache_path, "rb") as f:
+                        framework_cache = pickle.load(f)
+
+                    # keep completions requested while loading
+                    for framework, completions in framework_cache.items():
+                        self.framework_cache.setdefault(framework, completions)
+            finally:
+                self.framework_cache_loaded.set()
+
+
+    def save_framework_cache(self):
+        """
+        """
+        # do not overwrite the cache on disk before it is loaded
+        if not self.framework_cache_loaded.is_set():
+            return
+
+        if not os.path.exists(self.cache_path):
+            os.makedirs(self.cache_path)
+
+        framework_cache_path = os.path.join(self.cache_path, "frameworks.cache")
+
+        with open(framework_cache_path, "wb") as f:
+            pickle.dump(self.framework_cache, f)
+
+
+    def _get_persistent_cache(self, options):
+        """Get the persistent cache of the project in options, or None.
+        """
+        max_size = options.get("persistent_cache_size", 0)
+
+        if self.cache_path is None or not max_size or not options.get("file_name"):
+            return None
+
+        project = options.get("project") or ""
+        if project not in self.persistent_caches:
+            digest = hashlib.sha1(project.encode("utf-8")).hexdigest()
+            path = os.path.join(self.cache_path, "completions", digest)
+            self.persistent_caches[project] = PersistentCache(path, max_size)
+
+        return self.persistent_caches[project]
+
+
+    def _persistent_key(self, stub, options):
+        """
+        """
+        return [
+            options["file_name"],
+            stub,
+            sorted(set(options.get("imports", []))),
+            options.get("compilerargs", "")
+        ]
+
+
+    def _load_persistent(self, stub, options):
+        """Load a cache entry for stub from the persistent cache. The entry
+        is stale, and its timestamp forces a request.
+        """
+        persistent_cache = self._get_persistent_cache(options)
+        if persistent_cache is None:
+            return None
+
+        completions = persistent_cache.get(self._persistent_key(stub, options))
+        if completions is None:
+            return None
+
+        return {
+            "completions" : completions,
+            "timestamp"   : 0,
+            "stale"       : True
+        }
+
+
+    def get_breaker_states(self):
+        """Get the state of circuit breakers which are not closed.
+        """
+        return get_breaker_states()
+
+
+    def _submit(self, key, func, options):
+        """
+        """
+        # no point in queueing requests while the breaker is open
+        if get_breaker("complete").state == "open":
+            return None
+
+        try:
+            limit = options.get("concurrent_request_limit", 4)
+            return self.scheduler.submit(key, func, limit)
+        except AutocompleteRequestError as e:
+            print(e)
+            return None
+
+
+    def request(self, text, offset, options, included=lambda item: True,
+            timeout=None):
+        """Run a SourceKitten completion request.
+        """
+        # get completion command
+        cmd = get_completion_cmd(
+            options.get("sourcekitten_binary", "sourcekitten"),
+            text, offset, options.get("compilerargs", ""))
+
+        def parse(f):
+            parser = ijson.parse(f)
+            return list(parse_completions(parser, included=included))
+
+        # run completion command
+        if timeout is None:
+            timeout = options.get("sourcekitten_timeout", 10.0)
+        return run_sourcekitten("complete", cmd, parse, timeout)
+
+
+    def _autocomplete(self, buffer_id, stub, text, offset, options, reduced):
+        """Request completions for a stub and cache them.
+
+        Returns True if the cached completions changed.
+        """
+        cache = self.cache.setdefault(buffer_id, {})
+        completions = []
+
+        if reduced is not None:
+            completions = self.request(reduced[0], reduced[1], options)
+
+        if not completions:
+            completions = self.request(text, offset, options)
+
+        # update cache timestamp if nothing has changed
+        if stub in cache and completions == cache[stub]["completions"]:
+            cache[stub]["timestamp"] = time.time()
+            cache[stub].pop("stale", None)
+            return False
+
+        # cache completions for this buffer associated with stub
+        cache[stub] = {
+            "completions" : completions,
+            "timestamp"   : time.time()
+        }
+
+        persistent_cache = self._get_persistent_cache(options)
+        if persistent_cache is not None:
+            persistent_cache.put(self._persistent_key(stub, options), completions)
+
+        return True
+
+
+    def _autocomplete_framework(self, framework, options):
+        """
+        """
+        text = "import " + framework + "; "
+        completions = self.request(text, len(text), options,
+            included=included_framework_item,
+            timeout=options.get("framework_timeout", 120.0))
+        self.framework_cache[framework] = completions
+        return True
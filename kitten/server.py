@@ -0,0 +1,412 @@
+"""
+JSON-RPC server for the completion engine.
+
+The server listens on a Unix socket, and speaks JSON-RPC 2.0 with one
+message per line. Methods are those of `CompletionEngine` listed in
+`methods`, plus `shutdown`. Params are passed by position or by name.
+
+Usage:
+
+    python -m kitten.server serve --socket PATH [--cache-path PATH]
+    python -m kitten.server bench FILE [--offset N] [--repeat N] [--socket PATH]
+    python -m kitten.server bench-import [--repeat N]
+
+`bench` runs completion requests at offset in FILE (at the end of the
+file by default), either on an engine in the same process, or through the
+server at `--socket`, and reports the time spent in each call.
+
+`bench-import` times importing the completion core in fresh interpreters,
+and the first uses which load its dependencies.
+"""
+import os
+import json
+import time
+import socket
+import functools
+import itertools
+import threading
+import sys
+import socketserver
+from collections import OrderedDict
+
+from . import core
+
+# import dependencies on first use
+argparse = core.LazyImport("argparse")
+subprocess = core.LazyImport("subprocess")
+
+
+# engine methods available through the server
+methods = [
+    "get_stub",
+    "complete",
+    "refresh",
+    "complete_frameworks",
+    "wait",
+    "get_stats",
+    "get_breaker_states",
+    "clear_cache",
+    "close_buffer",
+    "load_framework_cache",
+    "save_framework_cache"
+]
+
+# JSON-RPC error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+SERVER_ERROR = -32000
+
+
+
+class CompletionServerError(RuntimeError):
+    def __init__(self,*args,**kwargs):
+        RuntimeError.__init__(self,*args,**kwargs)
+
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    """Handles the messages of one client connection.
+    """
+
+    def handle(self):
+        """
+        """
+        for line in self.rfile:
+            try:
+                message = json.loads(line.decode("utf-8"))
+            except ValueError as e:
+                response = error_response(None, PARSE_ERROR, str(e))
+            else:
+                response = self.server.dispatch(message)
+
+            data = json.dumps(response).encode("utf-8") + b"\n"
+            self.wfile.write(data)
+            self.wfile.flush()
+
+
+
+class CompletionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server for a `CompletionEngine`.
+
+    The server shuts down after idle_timeout seconds without messages.
+    """
+
+    daemon_threads = True
+
+
+    def __init__(self, path, engine, idle_timeout=3600):
+        """
+        """
+        if os.path.exists(path):
+            os.unlink(path)
+
+        socketserver.UnixStreamServer.__init__(self, path, RequestHandler)
+        self.path = path
+        self.engine = engine
+        self.idle_timeout = idle_timeout
+        self.last_message = time.time()
+
+
+    def dispatch(self, message):
+        """Call the engine method for a JSON-RPC message, and return the
+        response.
+        """
+        self.last_message = time.time()
+
+        if not isinstance(message, dict) or "method" not in message:
+            return error_response(None, INVALID_REQUEST, "Invalid request.")
+
+        message_id = message.get("id")
+        method = message["method"]
+        params = message.get("params", [])
+
+        if method == "shutdown":
+            threading.Thread(target=self.shutdown).start()
+            return result_response(message_id, None)
+
+        if method not in methods:
+            return error_response(message_id, METHOD_NOT_FOUND,
+                "Method not found: {method}".format(method=method))
+
+        func = getattr(self.engine, method)
+
+        try:
+            if isinstance(params, dict):
+                result = func(**params)
+            else:
+                result = func(*params)
+        except TypeError as e:
+            return error_response(message_id, INVALID_PARAMS, str(e))
+        except Exception as e:
+            return error_response(message_id, SERVER_ERROR, str(e))
+
+        return result_response(message_id, result)
+
+
+    def service_actions(self):
+        """
+        """
+        if self.idle_timeout and time.time() - self.last_message > self.idle_timeout:
+            threading.Thread(target=self.shutdown).start()
+
+
+    def server_close(self):
+        """
+        """
+        socketserver.UnixStreamServer.server_close(self)
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+
+def result_response(message_id, result):
+    """
+    """
+    return {"jsonrpc": "2.0", "id": message_id, "result": result}
+
+
+
+def error_response(message_id, code, message):
+    """
+    """
+    return {"jsonrpc": "2.0", "id": message_id,
+            "error": {"code": code, "message": message}}
+
+
+
+class Client(object):
+    """Client for a completion server, with the same methods as a
+    `CompletionEngine`.
+
+    Each call opens a new connection, so a client can be shared between
+    threads. Raises OSError if the server is not running.
+    """
+
+    def __init__(self, path, timeout=None):
+        """
+        """
+        self.path = path
+        self.timeout = timeout
+        self.ids = itertools.count(1)
+
+        for method in methods + ["shutdown"]:
+            setattr(self, method, functools.partial(self.call, method))
+
+
+    def call(self, method, *params):
+        """Call a server method, and return its result.
+        """
+        message = {
+            "jsonrpc" : "2.0",
+            "id"      : next(self.ids),
+            "method"  : method,
+            "params"  : params
+        }
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.path)
+            sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+
+            with sock.makefile("rb") as f:
+                line = f.readline()
+
+        if not line:
+            raise CompletionServerError("No response from completion server.")
+
+        response = json.loads(line.decode("utf-8"))
+
+        if "error" in response:
+            raise CompletionServerError(response["error"]["message"])
+
+        return response["result"]
+
+
+
+def start_server(path, python_binary="python3", cache_path=None, env=None):
+    """Start a server process in the background, detached from this one.
+    """
+    cmd = [python_binary, "-m", "kitten.server", "serve", "--socket", path]
+
+    if cache_path is not None:
+        cmd += ["--cache-path", cache_path]
+
+    return subprocess.Popen(cmd, cwd=core_package_path(), env=env,
+        stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+
+def core_package_path():
+    """Get the directory containing the `kitten` package.
+    """
+    return os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+
+def serve(args):
+    """
+    """
+    engine = core.CompletionEngine(args.cache_path)
+
+    if args.cache_path is not None:
+        engine.load_framework_cache()
+
+    server = CompletionServer(args.socket, engine, args.idle_timeout)
+
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+
+def bench(args):
+    """
+    """
+    if args.socket is not None:
+        engine = Client(args.socket)
+    else:
+        engine = core.CompletionEngine()
+
+    with open(args.file, "r", encoding="utf-8") as f:
+        text = f.read()
+
+    offset = len(text) if args.offset is None else args.offset
+    text = text[:offset]
+    options = {
+        "sourcekitten_binary" : args.sourcekitten_binary,
+        "compilerargs"        : args.compilerargs,
+        "cache_timeout"       : args.cache_timeout
+    }
+
+    timings = {"get_stub": [], "complete": [], "wait": []}
+
+    def timed(name, func, *params):
+        start = time.perf_counter()
+        result = func(*params)
+        timings[name].append(time.perf_counter() - start)
+        return result
+
+    for i in range(args.repeat):
+        stub, raw_stub = timed("get_stub", engine.get_stub, text)
+        result = timed("complete", engine.complete, "bench", stub, raw_stub,
+            text, offset, options)
+        if result["request"] is not None:
+            timed("wait", engine.wait, result["request"])
+
+    print("stub: {stub!r}, {count} completions".format(
+        stub=stub, count=len(result["completions"])))
+
+    for name, times in sorted(timings.items()):
+        if times:
+            print("{name:10} calls {calls:4}  min {min:9.3f} ms  max {max:9.3f} ms  mean {mean:9.3f} ms".format(
+                name=name, calls=len(times),
+                min=min(times) * 1000, max=max(times) * 1000,
+                mean=sum(times) / len(times) * 1000
+            ))
+
+    print(engine.get_stats())
+
+
+
+# timed in a fresh interpreter by `bench_import`
+import_script = """
+import io, sys, json, time
+timings = []
+def timed(name, func):
+    start = time.perf_counter()
+    func()
+    timings.append((name, time.perf_counter() - start))
+timed("import kitten.core", lambda: __import__("kitten.core"))
+timed("import kitten.server", lambda: __import__("kitten.server"))
+loaded = [name for name in sys.argv[1:] if name in sys.modules]
+from kitten import core
+engine = core.CompletionEngine()
+timed("first stub", lambda: engine.get_stub("foo."))
+timed("first parse", lambda: list(core.ijson.parse(io.BytesIO(b"[]"))))
+print(json.dumps({"timings": timings, "loaded": loaded}))
+"""
+
+# dependencies which should not be loaded by importing the core
+heavy_modules = ["pygments", "ijson", "cffi", "pickle", "subprocess",
+    "xml.etree", "uuid", "argparse"]
+
+
+
+def bench_import(args):
+    """
+    """
+    timings = OrderedDict()
+    loaded = set()
+
+    for i in range(args.repeat):
+        output = subprocess.check_output(
+            [sys.executable, "-c", import_script] + heavy_modules,
+            cwd=core_package_path(), stderr=subprocess.DEVNULL)
+        result = json.loads(output.decode("utf-8").splitlines()[-1])
+
+        for name, seconds in result["timings"]:
+            timings.setdefault(name, []).append(seconds)
+
+        if i == 0:
+            loaded.update(result["loaded"])
+
+    for name, times in timings.items():
+        print("{name:22} min {min:9.3f} ms  mean {mean:9.3f} ms".format(
+            name=name, min=min(times) * 1000,
+            mean=sum(times) / len(times) * 1000))
+
+    print("loaded by import: {modules}".format(
+        modules=", ".join(sorted(loaded)) or "none"))
+
+
+
+def main(argv=None):
+    """
+    """
+    parser = argparse.ArgumentParser(prog="python -m kitten.server",
+        description="SwiftKitten completion server.")
+    subparsers = parser.add_subparsers(dest="command")
+
+    serve_parser = subparsers.add_parser("serve", help="run the server")
+    serve_parser.add_argument("--socket", required=True,
+        help="path of the Unix socket to listen on")
+    serve_parser.add_argument("--cache-path", default=None,
+        help="directory of the framework cache")
+    serve_parser.add_argument("--idle-timeout", type=float, default=3600,
+        help="seconds without messages before shutting down, 0 to never")
+
+    bench_parser = subparsers.add_parser("bench", help="time completion requests")
+    bench_parser.add_argument("file", help="Swift file to complete in")
+    bench_parser.add_argument("--offset", type=int, default=None,
+        help="completion offset, defaults to the end of the file")
+    bench_parser.add_argument("--repeat", type=int, default=10)
+    bench_parser.add_argument("--socket", default=None,
+        help="benchmark the server at this socket instead of an engine in this process")
+    bench_parser.add_argument("--sourcekitten-binary", default="sourcekitten")
+    bench_parser.add_argument("--compilerargs", default="")
+    bench_parser.add_argument("--cache-timeout", type=float, default=1.0)
+
+    bench_import_parser = subparsers.add_parser("bench-import",
+        help="time importing the completion core")
+    bench_import_parser.add_argument("--repeat", type=int, default=10)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "serve":
+        serve(args)
+    elif args.command == "bench":
+        bench(args)
+    elif args.command == "bench-import":
+        bench_import(args)
+    else:
+        parser.print_help()
+
+
+
+if __name__ == "__main__":
+    main()